@@ -0,0 +1,136 @@
+# coding: utf-8
+"""
+Requests, bytes received and wall time of the calls made to the RHV API, per endpoint, e.g.
+'hosts' or 'hosts/{id}/nics'. The calls are counted for each scope they are made in, the
+inventory uses the name of the collection it is fetching.
+"""
+import functools
+import re
+import threading
+import time
+
+from contextlib import contextmanager
+
+# the ApiStats each thread counts its calls in, set by ApiStats.scope
+_active = threading.local()
+_ID = re.compile(r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$")
+
+
+def endpoint(path):
+    """The path of a request below the API root, with ids replaced, e.g. 'hosts/{id}/nics'."""
+    path = path.split("?", 1)[0]
+    if "/api" in path:
+        path = path.split("/api", 1)[1]
+    return "/".join(
+        "{id}" if _ID.match(part) else part for part in path.strip("/").split("/")
+    ) or "/"
+
+
+class ApiStats(object):
+    """Thread safe counters: (scope, endpoint) -> [requests, bytes, seconds]."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._records = dict()
+
+    @contextmanager
+    def scope(self, name):
+        """
+        Count the calls made by this thread meanwhile in these stats under name, whatever the
+        stats the connection was instrumented with, as a connection outlives the inventories
+        of the daemon.
+        """
+        previous = getattr(self._local, "scope", None), getattr(_active, "stats", None)
+        self._local.scope = name
+        _active.stats = self
+        try:
+            yield
+        finally:
+            self._local.scope, _active.stats = previous
+
+    def bind(self, func):
+        """func counting its calls in the scope of this thread, when run by another one."""
+        name = getattr(self._local, "scope", None)
+
+        @functools.wraps(func)
+        def bound(*args, **kwargs):
+            with self.scope(name):
+                return func(*args, **kwargs)
+        return bound
+
+    def record(self, path, seconds, nbytes):
+        key = (getattr(self._local, "scope", None), endpoint(path))
+        with self._lock:
+            record = self._records.setdefault(key, [0, 0, 0.0])
+            record[0] += 1
+            record[1] += nbytes
+            record[2] += seconds
+
+    def snapshot(self):
+        with self._lock:
+            return {key: list(record) for key, record in self._records.items()}
+
+
+def active_stats(connection):
+    """
+    The ApiStats the calls of this thread are counted in: the ones of its scope, otherwise the
+    ones the connection was instrumented with, if any.
+    """
+    return getattr(_active, "stats", None) or getattr(connection, "_api_stats", None)
+
+
+def diff(after, before):
+    """The calls of snapshot after that were not in snapshot before."""
+    calls = dict()
+    for key, record in after.items():
+        old = before.get(key, [0, 0, 0.0])
+        if record[0] != old[0]:
+            calls[key] = [new - prev for new, prev in zip(record, old)]
+    return calls
+
+
+def by_endpoint(calls, scopes=None, into=None):
+    """
+    Sum the calls of a snapshot per endpoint, only the ones made in scopes when given, into
+    the dict ``into`` when given.
+    """
+    merged = dict() if into is None else into
+    for (scope, path), record in calls.items():
+        if scopes is not None and scope not in scopes:
+            continue
+        total = merged.setdefault(path, [0, 0, 0.0])
+        for index, value in enumerate(record):
+            total[index] += value
+    return merged
+
+
+def instrument(connection, stats):
+    """
+    Record the requests of an ovirtsdk4 Connection in stats, or in the ones of the scope the
+    calling thread is in (see active_stats). The SDK sends a request, gets back a context
+    whose last item is the request, and waits for it later, possibly after sending others
+    (wait=False), so the time of a call runs from its send to its wait.
+    """
+    if getattr(connection, "_api_stats", None) is not None:
+        return connection
+    send, wait = connection.send, connection.wait
+    sent = dict()
+
+    def timed_send(request):
+        context = send(request)
+        sent[id(context)] = time.time()
+        return context
+
+    def timed_wait(context, *args, **kwargs):
+        start = sent.pop(id(context), None) or time.time()
+        response = wait(context, *args, **kwargs)
+        active_stats(connection).record(context[-1].path, time.time() - start,
+                                        len(response.body or b""))
+        return response
+
+    connection.send = timed_send
+    connection.wait = timed_wait
+    # read by rhv_stream, whose requests do not go through the SDK
+    connection._api_stats = stats
+    return connection
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Compare the way vm_count, template_count and locked_disks_count used to count (listing every
+object through wrapanapi) with the server side counts of the inventory, against a live RHV
+Manager. Prints the best wall time and the peak Python memory of each approach.
+
+    python benchmarks/bench_counts.py -R rhvm.example.com -u admin@internal -p secret
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from inventory import Inventory  # noqa: E402
+from wrapanapi.systems.rhevm import RHEVMSystem  # noqa: E402
+
+
+def measure(func, repeat):
+    """Best wall time over repeat runs, and the peak memory allocated by one run."""
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        value = func()
+        times.append(time.time() - start)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return value, min(times), peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-R", "--rhv-manager-url", dest="rhvm", required=True)
+    parser.add_argument("-u", "--user", dest="user", required=True)
+    parser.add_argument("-p", "--password", dest="password", required=True)
+    parser.add_argument("-n", "--repeat", dest="repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    system = RHEVMSystem(args.rhvm, args.user, args.password, version=4.3)
+
+    def new(count):
+        # a fresh inventory per run, so nothing is served from memory
+        return lambda: getattr(Inventory(system, ttl=0), count)()
+
+    cases = [
+        ("vm_count", lambda: len(system.list_vms()), new("vm_count")),
+        ("template_count", lambda: len(system.list_templates()), new("template_count")),
+        ("locked_disks_count", lambda: len(system.list_disks(status="LOCKED")),
+         new("locked_disk_count")),
+    ]
+
+    print("{:<20} {:>8} {:>10} {:>12} {:>8} {:>10} {:>12}".format(
+        "measurement", "count", "before s", "before KiB", "count", "after s", "after KiB"
+    ))
+    for name, before, after in cases:
+        before_count, before_time, before_peak = measure(before, args.repeat)
+        after_count, after_time, after_peak = measure(after, args.repeat)
+        print("{:<20} {:>8} {:>10.3f} {:>12.0f} {:>8} {:>10.3f} {:>12.0f}".format(
+            name, before_count, before_time, before_peak / 1024.0,
+            after_count, after_time, after_peak / 1024.0
+        ))
+
+
+if __name__ == "__main__":
+    main()
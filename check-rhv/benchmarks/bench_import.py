@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Measure the import time of the plugin with python -X importtime, for each way it is started:
+as a thin client of check_rhv_daemon, running the API checks, and running services_status.
+Prints the total and the slowest top level imports of each, and exits with 1 when a total is
+over --max-ms or a module listed as forbidden for a scenario was imported.
+
+    python benchmarks/bench_import.py --max-ms 400
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# statements run by each scenario, and the modules it must not import
+SCENARIOS = [
+    ("socket client", "import check_rhv_main",
+     ("ovirtsdk4", "paramiko", "wrapanapi", "numpy", "disk_cache", "state_store")),
+    ("api checks", "import check_rhv_main, rhv_checks, rhv_system",
+     ("paramiko", "wrapanapi", "numpy")),
+    ("services_status", "import check_rhv_main, rhv_checks, rhv_system, paramiko",
+     ("wrapanapi",)),
+]
+
+
+def import_times(statement):
+    """
+    Modules imported by statement in a fresh interpreter, and the cumulative microseconds of
+    each top level import. Raises ImportError when statement fails, e.g. for a missing package.
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=PLUGIN_DIR, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    if process.returncode != 0:
+        raise ImportError(process.stderr.strip().splitlines()[-1])
+    modules, top_level = set(), dict()
+    for line in process.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = line.split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        # nested imports are indented below the module importing them
+        name = fields[2][1:]
+        modules.add(name.strip())
+        if not name.startswith(" "):
+            top_level[name] = int(fields[1])
+    return modules, top_level
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--repeat", dest="repeat", type=int, default=5,
+                        help="runs per scenario, the best one is kept")
+    parser.add_argument("--max-ms", dest="max_ms", type=float, default=None,
+                        help="fail when a scenario takes longer to import")
+    parser.add_argument("--top", dest="top", type=int, default=8)
+    args = parser.parse_args()
+
+    failed = False
+    for name, statement, forbidden in SCENARIOS:
+        try:
+            runs = [import_times(statement) for _ in range(args.repeat)]
+        except ImportError as e:
+            # e.g. paramiko for services_status, not installed where the checks are not run
+            print("{}: skipped, {}".format(name, e))
+            continue
+        modules, top_level = min(runs, key=lambda run: sum(run[1].values()))
+        total_ms = sum(top_level.values()) / 1000.0
+        packages = set(module.split(".")[0] for module in modules)
+        found = [module for module in forbidden if module in packages]
+
+        print("{}: {:.1f} ms ({})".format(name, total_ms, statement))
+        for module, us in sorted(top_level.items(), key=lambda item: -item[1])[:args.top]:
+            print("    {:<30} {:>8.1f} ms".format(module, us / 1000.0))
+        if found:
+            failed = True
+            print("    FAIL imports {}".format(", ".join(found)))
+        if args.max_ms is not None and total_ms > args.max_ms:
+            failed = True
+            print("    FAIL over {:.0f} ms".format(args.max_ms))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,402 @@
+# coding: utf-8
+"""
+In-process stand-in for the RHV Manager REST API, serving a synthetic inventory of any size
+to the real ovirtsdk4 and to rhv_stream, so the checks can be measured without a live manager.
+Only what the checks read is served: the SSO token, the API summary, hosts (and their NICs),
+storage domains, datacenters (and their attached storage domains), VMs with their disks,
+templates and disks, with the 'search' queries the checks use.
+
+    with FakeRHV(SyntheticInventory.of_size(1000)) as api:
+        system = api.system()
+        result = CHECKS["hosts_status"](system)
+        print(api.request_count)
+"""
+import json
+import os
+import random
+import socketserver
+import sys
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+from urllib.parse import parse_qs
+from urllib.parse import urlsplit
+from xml.sax.saxutils import escape
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rhv_system import RHVSystem  # noqa: E402
+
+API_PREFIX = "/ovirt-engine/api"
+SSO_PATH = "/ovirt-engine/sso/oauth/token"
+TOKEN = "fake-sso-token"
+GiB = 1024 ** 3
+
+
+def _id(kind, index):
+    return "{:08x}-0000-4000-8000-{:012x}".format(kind, index)
+
+
+class SyntheticInventory(object):
+    """
+    Deterministic inventory: every n-th object is in a degraded state, so the checks go
+    through all their branches. Objects are plain dicts.
+    """
+
+    def __init__(self, hosts=10, vms=10, storage_domains=10, data_centers=1, templates=5,
+                 locked_disks=1, seed=0):
+        rand = random.Random(seed)
+        self.data_centers = [
+            {"id": _id(1, i), "name": "dc{}".format(i),
+             "status": "maintenance" if i % 50 == 49 else "up"}
+            for i in range(data_centers)
+        ]
+        # one cluster per datacenter
+        self.clusters = [
+            {"id": _id(9, i), "name": "cluster{}".format(i), "data_center": dc["id"]}
+            for i, dc in enumerate(self.data_centers)
+        ]
+        self.storage_domains = []
+        for i in range(storage_domains):
+            used = rand.randint(1, 900)
+            self.storage_domains.append({
+                "id": _id(2, i), "name": "sd{}".format(i),
+                "type": "image" if i % 20 == 19 else "data",
+                "external_status": "warning" if i % 25 == 24 else "ok",
+                "status": "maintenance" if i % 30 == 29 else "active",
+                "used": used * GiB, "available": (1000 - used) * GiB,
+                # every 40th domain is not attached to any datacenter
+                "data_center": (None if i % 40 == 39
+                                else self.data_centers[i % data_centers]["id"]),
+            })
+        data_sds = [sd for sd in self.storage_domains if sd["type"] == "data"] or [None]
+        self.vms = [
+            {"id": _id(3, i), "name": "vm{}".format(i), "host": i % max(1, hosts),
+             "storage_domain": data_sds[i % len(data_sds)]}
+            for i in range(vms)
+        ]
+        vms_per_host = [0] * hosts
+        for vm in self.vms:
+            if hosts:
+                vms_per_host[vm["host"]] += 1
+        self.hosts = []
+        for i in range(hosts):
+            self.hosts.append({
+                "id": _id(4, i), "name": "host{}".format(i),
+                "status": "maintenance" if i % 20 == 19 else "up",
+                "vms": vms_per_host[i],
+                "score": 2400 if i % 10 == 9 else 3400,
+                "address": "192.0.2.{}".format(i % 254 + 1),
+                "cluster": self.clusters[i % len(self.clusters)]["id"],
+                # every 4th host is twice as large
+                "cores": 16 if i % 4 == 3 else 8,
+                "memory": (512 if i % 4 == 3 else 256) * GiB,
+            })
+        self.templates = [{"id": _id(5, 0), "name": "Blank"}] + [
+            {"id": _id(5, i + 1), "name": "template{}".format(i)} for i in range(templates)
+        ]
+        self.disks = [
+            {"id": _id(6, i), "name": "disk{}".format(i),
+             "status": "locked" if i < locked_disks else "ok"}
+            for i in range(max(locked_disks, vms))
+        ]
+        self.events = []
+        self.add_event()
+
+    def add_event(self, host=None, storage_domain=None, data_center=None):
+        """Log an event of the engine about the objects with these ids."""
+        self.events.append({"id": str(len(self.events) + 1), "host": host,
+                            "storage_domain": storage_domain, "data_center": data_center})
+
+    @classmethod
+    def of_size(cls, size, seed=0):
+        """size hosts, VMs and storage domains, one datacenter per 100 storage domains."""
+        return cls(hosts=size, vms=size, storage_domains=size,
+                   data_centers=max(1, size // 100), templates=max(1, size // 10),
+                   locked_disks=max(1, size // 100), seed=seed)
+
+
+def _tag(name, value):
+    return "<{0}>{1}</{0}>".format(name, escape(str(value)))
+
+
+def _bool(value):
+    return "true" if value else "false"
+
+
+class Renderer(object):
+    """XML documents of the API for a SyntheticInventory, as the engine would send them."""
+
+    def __init__(self, inventory):
+        self.inventory = inventory
+        self.data_centers = {dc["id"]: dc for dc in inventory.data_centers}
+        self.hosts = {host["id"]: host for host in inventory.hosts}
+
+    def render(self, path, query):
+        """The XML of GET path (below the API root) with the query, None for a 404."""
+        parts = [part for part in path.strip("/").split("/") if part]
+        search = query.get("search", [""])[0]
+        if not parts:
+            return self.api()
+        if parts == ["hosts"]:
+            all_content = query.get("all_content", ["false"])[0] == "true"
+            return self.collection("hosts", "host", self.inventory.hosts,
+                                   lambda host: self.host(host, all_content))
+        if len(parts) == 3 and parts[0] == "hosts" and parts[2] == "nics":
+            host = self.hosts.get(parts[1])
+            return None if host is None else self.nics(host)
+        if parts == ["storagedomains"]:
+            return self.collection("storage_domains", "storage_domain",
+                                   self.inventory.storage_domains, self.storage_domain)
+        if parts == ["clusters"]:
+            return self.collection("clusters", "cluster", self.inventory.clusters, self.named)
+        if parts == ["datacenters"]:
+            return self.collection("data_centers", "data_center", self.inventory.data_centers,
+                                   self.data_center)
+        if len(parts) == 3 and parts[0] == "datacenters" and parts[2] == "storagedomains":
+            if parts[1] not in self.data_centers:
+                return None
+            attached = [sd for sd in self.inventory.storage_domains
+                        if sd["data_center"] == parts[1]]
+            return self.collection("storage_domains", "storage_domain", attached,
+                                   lambda sd: self.storage_domain(sd, attached=True))
+        if parts == ["vms"]:
+            follow = "disk_attachments" in query.get("follow", [""])[0]
+            return self.collection("vms", "vm", self.inventory.vms,
+                                   lambda vm: self.vm(vm, follow))
+        if parts == ["templates"]:
+            templates = self.inventory.templates
+            if search.replace(" ", "") == "name!=Blank":
+                templates = [t for t in templates if t["name"] != "Blank"]
+            return self.collection("templates", "template", templates, self.named)
+        if parts == ["disks"]:
+            disks = self.inventory.disks
+            if search.replace(" ", "") == "status=locked":
+                disks = [disk for disk in disks if disk["status"] == "locked"]
+            return self.collection("disks", "disk", disks, self.disk)
+        if parts == ["events"]:
+            # the newest first, only the ones after 'from' when given
+            since = int(query.get("from", ["0"])[0])
+            events = [event for event in reversed(self.inventory.events)
+                      if int(event["id"]) > since]
+            return self.collection("events", "event",
+                                   events[:int(query.get("max", [len(events)])[0])], self.event)
+        return None
+
+    @staticmethod
+    def collection(tag, item_tag, items, render):
+        return "<{0}>{1}</{0}>".format(tag, "".join(
+            '<{0} href="{1}/{2}s/{3}" id="{3}">{4}</{0}>'.format(
+                item_tag, API_PREFIX, item_tag.replace("_", ""), item["id"], render(item)
+            ) for item in items
+        ))
+
+    def api(self):
+        inventory = self.inventory
+
+        def totals(name, items, active):
+            return "<{0}><active>{1}</active><total>{2}</total></{0}>".format(
+                name, active, len(items)
+            )
+        return ("<api><product_info><name>oVirt Engine</name></product_info><summary>"
+                + totals("hosts", inventory.hosts,
+                         len([h for h in inventory.hosts if h["status"] == "up"]))
+                + totals("storage_domains", inventory.storage_domains,
+                         len([sd for sd in inventory.storage_domains
+                              if sd["status"] == "active"]))
+                + totals("users", [], 0)
+                + totals("vms", inventory.vms, len(inventory.vms))
+                + "</summary></api>")
+
+    @staticmethod
+    def named(item):
+        return _tag("name", item["name"])
+
+    @staticmethod
+    def host(host, all_content):
+        xml = (_tag("name", host["name"]) + _tag("address", host["address"])
+               + _tag("status", host["status"])
+               + '<cluster id="{}"/>'.format(host["cluster"])
+               + "<cpu><topology>{}</topology></cpu>".format(
+                   _tag("cores", host["cores"]) + _tag("sockets", 2) + _tag("threads", 2))
+               + _tag("memory", host["memory"])
+               + "<summary>{}</summary>".format(_tag("total", host["vms"])))
+        if all_content:
+            xml += "<hosted_engine>{}</hosted_engine>".format(
+                _tag("active", _bool(True)) + _tag("configured", _bool(True))
+                + _tag("global_maintenance", _bool(False))
+                + _tag("local_maintenance", _bool(host["status"] == "maintenance"))
+                + _tag("score", host["score"])
+            )
+        return xml
+
+    @staticmethod
+    def nics(host):
+        return ('<host_nics><host_nic id="{}">{}<ip>{}</ip></host_nic></host_nics>'.format(
+            _id(7, int(host["id"][-12:], 16)), _tag("name", "eth0"),
+            _tag("address", host["address"])
+        ))
+
+    @staticmethod
+    def storage_domain(sd, attached=False):
+        xml = (_tag("name", sd["name"]) + _tag("type", sd["type"])
+               + _tag("used", sd["used"]) + _tag("available", sd["available"]))
+        if attached:
+            return xml + _tag("status", sd["status"])
+        return xml + _tag("external_status", sd["external_status"])
+
+    @staticmethod
+    def data_center(dc):
+        return _tag("name", dc["name"]) + _tag("status", dc["status"])
+
+    @staticmethod
+    def disk(disk):
+        return _tag("name", disk["name"]) + _tag("status", disk["status"])
+
+    @staticmethod
+    def event(event):
+        return "".join(
+            '<{} id="{}"/>'.format(link, event[link])
+            for link in ("host", "storage_domain", "data_center") if event[link] is not None
+        )
+
+    @staticmethod
+    def vm(vm, follow):
+        xml = _tag("name", vm["name"])
+        if follow and vm["storage_domain"] is not None:
+            xml += (
+                '<disk_attachments><disk_attachment id="{0}"><disk id="{0}">'
+                '<storage_domains><storage_domain id="{1}"/></storage_domains>'
+                '</disk></disk_attachment></disk_attachments>'
+            ).format(_id(8, int(vm["id"][-12:], 16)), vm["storage_domain"]["id"])
+        return xml
+
+
+class FakeRequestHandler(BaseHTTPRequestHandler):
+    # keep-alive, as the engine does
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, do not let Nagle delay the body
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, code, body, content_type="application/xml"):
+        body = body.encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        api = self.server.api
+        length = int(self.headers.get("Content-Length") or 0)
+        form = parse_qs(self.rfile.read(length).decode("utf-8"))
+        url = urlsplit(self.path)
+        api.count(url.path)
+        if url.path != SSO_PATH:
+            # e.g. the SSO logout of Connection.close()
+            return self._send(200, "{}", "application/json")
+        if (form.get("username", [None])[0], form.get("password", [None])[0]) != api.credentials:
+            return self._send(400, json.dumps({
+                "error_code": "access_denied", "error": "Cannot authenticate user"
+            }), "application/json")
+        self._send(200, json.dumps({"access_token": TOKEN, "token_type": "bearer"}),
+                   "application/json")
+
+    def do_GET(self):
+        api = self.server.api
+        url = urlsplit(self.path)
+        api.count(url.path)
+        if self.headers.get("Authorization") != "Bearer " + TOKEN:
+            return self._send(401, "<fault><reason>Unauthorized</reason></fault>")
+        if not url.path.startswith(API_PREFIX):
+            return self._send(404, "<fault><reason>Not found</reason></fault>")
+        body = api.body(url.path[len(API_PREFIX):], url.query)
+        if api.latency:
+            time.sleep(api.latency)
+        if body is None:
+            return self._send(404, "<fault><reason>Not found</reason></fault>")
+        self._send(200, body)
+
+
+class FakeServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    # the listings sent with wait=False all connect at once
+    request_queue_size = 128
+
+
+class FakeRHV(object):
+    """
+    The fake API listening on a free local port. ``latency`` seconds are added to each API
+    response, as the engine takes time to answer. Responses are rendered once per path and
+    query, so serving them costs next to nothing in the measurements.
+    """
+
+    def __init__(self, inventory, username="admin@internal", password="secret", latency=0.0):
+        self.renderer = Renderer(inventory)
+        self.credentials = (username, password)
+        self.latency = latency
+        self.requests = dict()
+        self._bodies = dict()
+        self._lock = threading.Lock()
+        self._server = None
+
+    def start(self):
+        self._server = FakeServer(("127.0.0.1", 0), FakeRequestHandler)
+        self._server.api = self
+        thread = threading.Thread(target=self._server.serve_forever, name="fake-rhv")
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def address(self):
+        return "{}:{}".format(*self._server.server_address)
+
+    def system(self):
+        """A new RHVSystem logging in to this API."""
+        host, port = self._server.server_address
+        return RHVSystem(host, self.credentials[0], self.credentials[1], port=port,
+                         scheme="http")
+
+    def count(self, path):
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+    @property
+    def request_count(self):
+        """API requests received, not counting the SSO ones."""
+        with self._lock:
+            return sum(n for path, n in self.requests.items() if path.startswith(API_PREFIX))
+
+    def reset(self):
+        with self._lock:
+            self.requests.clear()
+
+    def changed(self):
+        """Render the responses again, after the inventory was modified."""
+        with self._lock:
+            self._bodies.clear()
+
+    def body(self, path, query):
+        key = (path.rstrip("/"), query)
+        body = self._bodies.get(key)
+        if body is None:
+            body = self.renderer.render(path, parse_qs(query))
+            with self._lock:
+                self._bodies[key] = body
+        return body
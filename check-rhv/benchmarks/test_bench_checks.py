@@ -0,0 +1,112 @@
+# coding: utf-8
+"""
+Latency, API request count and peak memory of every check against the fake RHV API, for
+synthetic inventories of several sizes (10 to 10,000 hosts, VMs and storage domains, set
+RHV_BENCH_SIZES to change them):
+
+    python -m pytest benchmarks/test_bench_checks.py --benchmark-columns=min,mean,max
+
+The request count of each check is asserted, so a change listing objects one by one fails
+here rather than on a large engine. Needs ovirtsdk4 and pytest-benchmark.
+"""
+import logging
+import os
+import sys
+import tracemalloc
+
+import pytest
+
+pytest.importorskip("ovirtsdk4")
+pytest.importorskip("pytest_benchmark")
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from check_result import CheckResult  # noqa: E402
+from check_result import STATE_NAMES  # noqa: E402
+from fake_rhv import FakeRHV  # noqa: E402
+from fake_rhv import SyntheticInventory  # noqa: E402
+from inventory import Inventory  # noqa: E402
+from rhv_checks import CHECKS  # noqa: E402
+from rhv_checks import EVENT_TRACKED_CHECKS  # noqa: E402
+from state_store import StateStore  # noqa: E402
+
+SIZES = [int(size) for size in os.environ.get("RHV_BENCH_SIZES", "10,1000,10000").split(",")]
+
+# API requests of each check for an inventory, whatever its size
+REQUESTS = {
+    "vm_count": lambda inventory: 1,
+    "template_count": lambda inventory: 1,
+    "locked_disks_count": lambda inventory: 1,
+    "storage_domain_status": lambda inventory: 1,
+    "storage_domain_usage": lambda inventory: 2,
+    "hosts_status": lambda inventory: 1,
+    "datacenter_status": lambda inventory: 1,
+    # one listing of the attached storage domains per datacenter
+    "storage_domain_attached": lambda inventory: 2 + len(inventory.data_centers),
+    # the hosts and the names of their clusters
+    "vms_distributed_hosts": lambda inventory: 2,
+    "hosted_engine_status": lambda inventory: 1,
+}
+
+
+@pytest.fixture(scope="module", params=SIZES, ids=lambda size: "size{}".format(size))
+def fake_api(request):
+    with FakeRHV(SyntheticInventory.of_size(request.param)) as api:
+        yield api
+
+
+def run_check(api, measurement, **kwargs):
+    # a new connection and inventory each time, nothing is served from memory
+    system = api.system()
+    try:
+        return CHECKS[measurement](system, logger=logging.getLogger("bench"),
+                                   inventory=Inventory(system, ttl=0), **kwargs)
+    finally:
+        system.disconnect()
+
+
+def test_check_count():
+    # services_status needs SSH access to the hosts, it can not run against the fake API
+    assert set(REQUESTS) == set(CHECKS) - {"services_status"}
+
+
+@pytest.mark.parametrize("measurement", sorted(REQUESTS))
+def test_check(benchmark, fake_api, measurement):
+    # the first run renders the responses of the fake API, out of the measurements
+    run_check(fake_api, measurement)
+
+    fake_api.reset()
+    tracemalloc.start()
+    try:
+        result = run_check(fake_api, measurement)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    requests = fake_api.request_count
+
+    benchmark.extra_info["requests"] = requests
+    benchmark.extra_info["peak_kib"] = round(peak / 1024.0, 1)
+    benchmark.pedantic(run_check, args=(fake_api, measurement), rounds=3, iterations=1)
+
+    assert isinstance(result, CheckResult)
+    assert result.state in STATE_NAMES
+    assert requests == REQUESTS[measurement](fake_api.renderer.inventory)
+
+
+@pytest.mark.parametrize("measurement", sorted(EVENT_TRACKED_CHECKS))
+def test_tracked_check(benchmark, fake_api, measurement):
+    # once the state store knows the objects, no event since means a single request
+    state_store = StateStore()
+    run_check(fake_api, measurement, state_store=state_store)
+
+    fake_api.reset()
+    result = run_check(fake_api, measurement, state_store=state_store)
+    requests = fake_api.request_count
+
+    benchmark.extra_info["requests"] = requests
+    benchmark.pedantic(run_check, args=(fake_api, measurement),
+                       kwargs={"state_store": state_store}, rounds=3, iterations=1)
+
+    assert result.state in STATE_NAMES
+    assert requests == 1
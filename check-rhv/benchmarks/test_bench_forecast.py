@@ -0,0 +1,67 @@
+# coding: utf-8
+"""
+Time of the days-to-full projection of storage_domain_usage --forecast over weeks of history
+for a large number of storage domains, which must stay well under a second per run:
+
+    python -m pytest benchmarks/test_bench_forecast.py --benchmark-columns=min,mean,max
+
+Needs numpy and pytest-benchmark.
+"""
+import os
+import sys
+
+import pytest
+
+numpy = pytest.importorskip("numpy")
+pytest.importorskip("pytest_benchmark")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from usage_history import DAY  # noqa: E402
+from usage_history import HOUR  # noqa: E402
+from usage_history import SAMPLE  # noqa: E402
+from usage_history import UsageHistory  # noqa: E402
+
+NOW = 1.8e9
+STORAGE_DOMAINS = 100
+WEEKS = 4
+GiB = 2 ** 30
+
+
+def growth(index):
+    """GiB a day written to storage domain index, every 4th one does not grow."""
+    return 0.0 if index % 4 == 0 else float(index)
+
+
+def write_history(history, index):
+    """WEEKS of hourly averages and 2 days of samples every 5 minutes, as append leaves them."""
+    raw_start = NOW - history.raw_days * DAY
+    for tier, start, stop, step in (("hourly", NOW - WEEKS * 7 * DAY, raw_start, HOUR),
+                                    ("raw", raw_start, NOW, 300.0)):
+        samples = numpy.empty(int((stop - start) // step), dtype=SAMPLE)
+        samples["time"] = start + step * numpy.arange(len(samples))
+        samples["used"] = (100 + growth(index) * (samples["time"] - NOW) / DAY) * 100 * GiB
+        samples["available"] = 1000 * 100 * GiB - samples["used"]
+        with open(history._path("sd{}".format(index), tier), "wb") as history_file:
+            history_file.write(samples.tobytes())
+
+
+@pytest.fixture(scope="module")
+def history(tmpdir_factory):
+    history = UsageHistory(str(tmpdir_factory.mktemp("usage")))
+    for index in range(STORAGE_DOMAINS):
+        write_history(history, index)
+    return history
+
+
+def test_days_to_full(benchmark, history):
+    ids = ["sd{}".format(index) for index in range(STORAGE_DOMAINS)]
+    days_to_full = benchmark(history.days_to_full, ids, window_days=WEEKS * 7, now=NOW)
+
+    assert len(days_to_full) == STORAGE_DOMAINS
+    for index in range(STORAGE_DOMAINS):
+        expected = float("inf") if not growth(index) else (1000 - 100) / growth(index)
+        assert days_to_full["sd{}".format(index)] == pytest.approx(expected, rel=1e-6)
+    if not benchmark.disabled:
+        # no timings under --benchmark-disable
+        assert benchmark.stats.stats.mean < 0.5
@@ -0,0 +1,83 @@
+# coding: utf-8
+"""
+Result of a check, returned by the functions in rhv_checks and turned into plugin output and
+an exit code by check_rhv_main.
+"""
+from collections import namedtuple
+
+OK, WARNING, CRITICAL, UNKNOWN = 0, 1, 2, 3
+
+STATE_NAMES = {OK: "OK", WARNING: "WARNING", CRITICAL: "CRITICAL", UNKNOWN: "UNKNOWN"}
+# order in which states win when several results are combined, same as inside the checks
+STATE_SEVERITY = (CRITICAL, WARNING, UNKNOWN, OK)
+
+
+class Perfdata(namedtuple("Perfdata", "label value warn crit min max uom")):
+    """
+    One 'label=value[uom];warn;crit;min;max' performance data item. warn and crit are numbers
+    or Nagios ranges, e.g. '3400:' to alert below 3400.
+    """
+    __slots__ = ()
+
+    def __new__(cls, label, value, warn=None, crit=None, min=None, max=None, uom=""):
+        return super(Perfdata, cls).__new__(cls, label, value, warn, crit, min, max, uom)
+
+    def __str__(self):
+        label = self.label
+        if any(c in label for c in " '="):
+            label = "'{}'".format(label.replace("'", "_").replace("=", "_"))
+        values = ["" if v is None else "{:g}".format(v) if isinstance(v, float) else str(v)
+                  for v in (self.value, self.warn, self.crit, self.min, self.max)]
+        values[0] += self.uom or ""
+        return "{}={}".format(label, ";".join(values).rstrip(";"))
+
+
+class CheckResult(object):
+    """
+    The outcome of one check: Nagios state, human readable message, performance data and the
+    time spent in the check.
+    """
+    __slots__ = ("state", "message", "perfdata", "timings")
+
+    def __init__(self, state, message, perfdata=None, timings=None):
+        self.state = state if state in STATE_NAMES else UNKNOWN
+        self.message = message
+        self.perfdata = list(perfdata or [])
+        self.timings = dict(timings or {})
+
+    @property
+    def state_name(self):
+        return STATE_NAMES[self.state]
+
+    def output(self):
+        """Plugin output: the message followed by the perfdata, if any."""
+        if not self.perfdata:
+            return self.message
+        return "{} | {}".format(self.message, " ".join(str(p) for p in self.perfdata))
+
+    def to_dict(self):
+        return {
+            "state": self.state,
+            "message": self.message,
+            "perfdata": [list(p) for p in self.perfdata],
+            "timings": self.timings,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            data["state"],
+            data["message"],
+            [Perfdata(*p) for p in data.get("perfdata", [])],
+            data.get("timings"),
+        )
+
+    def __repr__(self):
+        return "CheckResult({}, {!r})".format(self.state_name, self.message)
+
+
+def worst_state(states):
+    for state in STATE_SEVERITY:
+        if state in states:
+            return state
+    return UNKNOWN
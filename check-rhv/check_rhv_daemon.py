@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Collector daemon keeping authenticated connections to one or more RHV Managers. It polls their
+inventory on a schedule and runs the checks asked by check_rhv_main.py --socket over a Unix
+domain socket, so the plugin itself never imports the RHV SDK nor logs in to the manager.
+
+Protocol: the client sends one JSON line
+    {"manager": "<rhvm>", "measurements": ["hosts_status", ...], "kwargs": {"warn": 5, ...}}
+and receives one JSON line
+    {"results": [{"name": "hosts_status", "state": 0, "message": "...", ...}, ...]}
+or {"error": "<reason>"}.
+"""
+import argparse
+import hashlib
+import json
+import os
+import socketserver
+import threading
+import time
+
+from argparse import RawTextHelpFormatter
+from check_rhv_main import get_measurement
+from check_rhv_main import get_measurements
+from check_rhv_main import get_system
+from check_rhv_main import run_checks
+from disk_cache import AddressCache
+from inventory import Inventory
+from rhv_engine import Engine
+from rhv_checks import CHECK_COLLECTIONS
+from rhv_logconf import get_logger
+from ssh_pool import SSHPool
+from state_store import StateStore
+
+
+class Manager(object):
+    """
+    One RHV Manager: its connection, its inventory, the SSH connections to its hosts, the
+    last status of its objects for the clients asking for changes, the usage history of its
+    storage domains when a history directory is given and the recent VM balance of its
+    clusters. The lock only guards swapping the inventory: the checks of the clients run
+    concurrently, so one waiting on a slow host does not hold up the others.
+    """
+
+    def __init__(self, rhvm, user, password, ttl, history_dir=None):
+        self.rhvm = rhvm
+        self.system = get_system(rhvm, user, password)
+        self.inventory = Inventory(self.system, ttl=ttl)
+        self.ssh_pool = SSHPool()
+        # the polls run alongside the checks, an event loop only runs one of them at a time
+        self.poll_engine = Engine()
+        self.address_cache = AddressCache()
+        self.state_store = StateStore()
+        self.balance_history = None
+        self.usage_history = None
+        if history_dir is not None:
+            from usage_history import UsageHistory
+            self.usage_history = UsageHistory(
+                os.path.join(history_dir, hashlib.sha1(rhvm.encode("utf-8")).hexdigest())
+            )
+        self.lock = threading.Lock()
+
+    def poll(self):
+        """
+        Refresh every collection the checks read, return the ones that failed. They are listed
+        into a new inventory, swapped in once done, so the checks keep being served the
+        previous listings meanwhile, and still are for the collections that failed.
+        """
+        collections = set(c for names in CHECK_COLLECTIONS.values() for c in names)
+        inventory = Inventory(self.system, ttl=self.inventory.ttl)
+        errors = inventory.prefetch(collections, engine=self.poll_engine)
+        with self.lock:
+            inventory.inherit(self.inventory)
+            self.inventory = inventory
+        self.ssh_pool.evict_idle()
+        return errors
+
+    def run(self, names, logger, **kwargs):
+        if kwargs.pop("track_changes", False):
+            kwargs["state_store"] = self.state_store
+        if kwargs.pop("forecast", False):
+            if self.usage_history is None:
+                raise ValueError("--forecast needs the daemon to be started with --history-dir")
+            kwargs["usage_history"] = self.usage_history
+        with self.lock:
+            if kwargs.get("balance_window"):
+                if self.balance_history is None:
+                    from vm_balance import SpreadHistory
+                    self.balance_history = SpreadHistory()
+                kwargs["balance_history"] = self.balance_history
+            # the one of the last poll, even if the next one swaps it meanwhile
+            inventory = self.inventory
+        # each request gets its own event loop, one only runs one request at a time
+        with Engine() as engine:
+            return run_checks(self.system, inventory, names, logger, ssh_pool=self.ssh_pool,
+                              address_cache=self.address_cache, engine=engine, **kwargs)
+
+
+class CheckRequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        server = self.server
+        try:
+            request = json.loads(self.rfile.readline().decode("utf-8"))
+            response = {"results": server.answer(request)}
+        except Exception as e:
+            server.logger.error("Failed to answer check request", exc_info=True)
+            response = {"error": str(e)}
+        self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+
+class CheckServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, managers, logger):
+        self.managers = managers
+        self.logger = logger
+        if os.path.exists(socket_path):
+            # left over by a previous run
+            os.unlink(socket_path)
+        socketserver.UnixStreamServer.__init__(self, socket_path, CheckRequestHandler)
+        os.chmod(socket_path, 0o660)
+
+    def answer(self, request):
+        rhvm = request.get("manager")
+        if rhvm is None and len(self.managers) == 1:
+            rhvm = list(self.managers.keys())[0]
+        manager = self.managers.get(rhvm)
+        if manager is None:
+            raise ValueError("RHV Manager {} is not handled by this daemon".format(rhvm))
+
+        names = request.get("measurements") or []
+        kwargs = request.get("kwargs", {})
+        if names == ["all"]:
+            names = get_measurements("all", services=kwargs.get("services"))
+        unknown = [name for name in names if not get_measurement(name)]
+        if unknown or not names:
+            raise ValueError(
+                "measurement(s) {} not understood".format(", ".join(map(str, unknown)))
+            )
+        if "services_status" in names and not kwargs.get("services"):
+            raise ValueError("services_status needs the services to check, given with --services")
+
+        results = manager.run(names, self.logger, **kwargs)
+        return [dict(result.to_dict(), name=name) for name, result in results]
+
+
+def poll_forever(managers, interval, logger):
+    while True:
+        for manager in managers.values():
+            try:
+                start = time.time()
+                for collection, error in manager.poll().items():
+                    logger.error("Failed to poll %s of %s: %s", collection, manager.rhvm, error)
+                logger.info("Polled inventory of %s in %.2fs, SSH connection pool: %s",
+                            manager.rhvm, time.time() - start, manager.ssh_pool.stats())
+            except Exception:
+                logger.error("Failed to poll inventory of %s", manager.rhvm, exc_info=True)
+        time.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=RawTextHelpFormatter)
+    parser.add_argument(
+        "-R",
+        "--rhv-manager-url",
+        dest="rhvm",
+        help="Hostname of RHV Manager, repeat for several managers",
+        action="append",
+        required=True,
+    )
+    parser.add_argument(
+        "-u",
+        "--user",
+        dest="user",
+        help="remote user to use",
+        type=str,
+    )
+    parser.add_argument(
+        "-p",
+        "--password",
+        dest="password",
+        help="password for the RHV Manager",
+        type=str
+    )
+    parser.add_argument(
+        "-S",
+        "--socket",
+        dest="socket",
+        help="Unix socket to listen on",
+        type=str,
+        default="/var/lib/shinken/check-rhv.sock",
+    )
+    parser.add_argument(
+        "-i",
+        "--poll-interval",
+        dest="poll_interval",
+        help="Seconds between two polls of the inventory",
+        type=float,
+        default=60,
+    )
+    parser.add_argument(
+        "--history-dir",
+        dest="history_dir",
+        help="Directory keeping the usage history of the storage domains, for the clients\n"
+             "running storage_domain_usage with --forecast",
+        type=str,
+    )
+    parser.add_argument(
+        "-l",
+        "--local",
+        dest="local",
+        help="Use this field when testing locally",
+        action="store_true",
+        default=False
+        )
+    args = parser.parse_args()
+    logger = get_logger(args.local)
+
+    # listings stay valid for two polls, so a single failed poll does not make every check
+    # hit the manager directly
+    managers = {
+        rhvm: Manager(rhvm, args.user, args.password, ttl=2 * args.poll_interval,
+                      history_dir=args.history_dir)
+        for rhvm in args.rhvm
+    }
+    poller = threading.Thread(
+        target=poll_forever, args=(managers, args.poll_interval, logger), name="poller"
+    )
+    poller.daemon = True
+    poller.start()
+
+    server = CheckServer(args.socket, managers, logger)
+    logger.info("Listening on %s for checks of %s", args.socket, ", ".join(managers))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(args.socket)
+
+
+if __name__ == "__main__":
+    main()
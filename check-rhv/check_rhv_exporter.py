@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Prometheus exporter for one or more RHV Managers. A background thread lists their inventory,
+runs the checks and, when services are given, the service checks over SSH on a schedule, then
+renders the metrics once. Scrapes of /metrics are answered from that rendered buffer, so they
+never wait for the RHV API and any number of scrapers cost nothing more to the engine.
+
+The Prometheus text format is sent by default, OpenMetrics to the scrapers asking for it, both
+gzipped when accepted.
+"""
+import argparse
+import gzip
+import json
+import time
+import threading
+
+from argparse import RawTextHelpFormatter
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+from socketserver import ThreadingMixIn
+
+from check_rhv_daemon import Manager
+from check_rhv_main import run_checks
+from rhv_checks import CHECKS
+from rhv_checks import services_states
+from rhv_logconf import get_logger
+from status_map import status_text
+
+TEXT_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+def _label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace("\"", "\\\"")
+
+
+def _sample_value(value):
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if value != value:
+        return "NaN"
+    if value in (float("inf"), float("-inf")):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+
+class Metrics(object):
+    """Gauges with their samples, grouped per family as both formats require."""
+
+    def __init__(self):
+        self._families = OrderedDict()
+
+    def add(self, name, value, help_text, **labels):
+        if value is None:
+            return
+        family = self._families.setdefault(name, (help_text, []))
+        family[1].append((labels, value))
+
+    def render(self, openmetrics=False):
+        lines = []
+        for name, (help_text, samples) in self._families.items():
+            lines.append("# HELP {} {}".format(name, help_text))
+            lines.append("# TYPE {} gauge".format(name))
+            for labels, value in samples:
+                label_text = ",".join(
+                    "{}=\"{}\"".format(key, _label_value(label))
+                    for key, label in sorted(labels.items())
+                )
+                lines.append("{}{} {}".format(
+                    name, "{" + label_text + "}" if label_text else "", _sample_value(value)
+                ))
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsBuffer(object):
+    """The last rendered metrics in every format and encoding, replaced all at once."""
+
+    def __init__(self):
+        self._bodies = None
+
+    def update(self, metrics):
+        bodies = dict()
+        for openmetrics in (False, True):
+            body = metrics.render(openmetrics=openmetrics).encode("utf-8")
+            bodies[(openmetrics, False)] = body
+            bodies[(openmetrics, True)] = gzip.compress(body)
+        self._bodies = bodies
+
+    def get(self, openmetrics, gzipped):
+        """The body to send, None until the first collection is done."""
+        bodies = self._bodies
+        return None if bodies is None else bodies[(openmetrics, gzipped)]
+
+
+def collect_inventory(metrics, manager):
+    """Metrics of the objects listed by the last poll of the manager."""
+    rhvm = manager.rhvm
+    inventory = manager.inventory
+    metrics.add("rhv_vms", inventory.vm_count(), "VMs of the manager", manager=rhvm)
+    metrics.add("rhv_templates", inventory.template_count(),
+                "Templates of the manager, but Blank", manager=rhvm)
+    metrics.add("rhv_locked_disks", inventory.locked_disk_count(), "Disks in the locked status",
+                manager=rhvm)
+
+    for host in inventory.hosts(all_content=True):
+        metrics.add("rhv_host_status", 1, "Status of the host, one sample per host",
+                    manager=rhvm, host=host.name, status=status_text(host.status))
+        metrics.add("rhv_host_vms", host.summary_total, "VMs running on the host",
+                    manager=rhvm, host=host.name)
+        if host.hosted_engine_configured:
+            metrics.add("rhv_hosted_engine_score", host.hosted_engine_score,
+                        "Hosted engine score of the host, 3400 at best",
+                        manager=rhvm, host=host.name)
+            metrics.add("rhv_hosted_engine_active", bool(host.hosted_engine_active),
+                        "Whether the hosted engine is active on the host",
+                        manager=rhvm, host=host.name)
+            metrics.add("rhv_hosted_engine_maintenance",
+                        bool(host.hosted_engine_local_maintenance
+                             or host.hosted_engine_global_maintenance),
+                        "Whether the hosted engine of the host is in maintenance",
+                        manager=rhvm, host=host.name)
+
+    for data_center in inventory.data_centers():
+        metrics.add("rhv_datacenter_status", 1,
+                    "Status of the datacenter, one sample per datacenter", manager=rhvm,
+                    datacenter=data_center.name, status=status_text(data_center.status))
+
+    for storage_domain in inventory.storage_domains():
+        labels = dict(manager=rhvm, storage_domain=storage_domain.name)
+        metrics.add("rhv_storage_domain_external_status", 1,
+                    "External status of the storage domain, one sample per domain",
+                    status=status_text(storage_domain.external_status), **labels)
+        if isinstance(storage_domain.used, int) and isinstance(storage_domain.available, int):
+            metrics.add("rhv_storage_domain_used_bytes", storage_domain.used,
+                        "Used space of the storage domain", **labels)
+            metrics.add("rhv_storage_domain_available_bytes", storage_domain.available,
+                        "Available space of the storage domain", **labels)
+
+
+def collect_services(metrics, manager, services, workers, host_timeout):
+    """State of the services of every host, checked over SSH."""
+    hosts_agents, unreachable = services_states(
+        manager.system, manager.inventory, services, workers=workers,
+        host_timeout=host_timeout, ssh_pool=manager.ssh_pool,
+        address_cache=manager.address_cache
+    )
+    for host_name, agents in hosts_agents.items():
+        metrics.add("rhv_host_services_reachable", True,
+                    "Whether the services of the host could be checked over SSH",
+                    manager=manager.rhvm, host=host_name)
+        for service, ok in agents.items():
+            metrics.add("rhv_host_service_ok", bool(ok),
+                        "Whether the service is in its desired state on the host",
+                        manager=manager.rhvm, host=host_name, service=service)
+    for host_name in unreachable:
+        metrics.add("rhv_host_services_reachable", False,
+                    "Whether the services of the host could be checked over SSH",
+                    manager=manager.rhvm, host=host_name)
+
+
+def collect(metrics, manager, services, workers, host_timeout, logger):
+    """Poll one manager and add its metrics, what could not be collected is logged."""
+    start = time.time()
+    errors = manager.poll()
+    for collection, error in errors.items():
+        logger.error("Failed to poll %s of %s: %s", collection, manager.rhvm, error)
+    failed = len(errors)
+    with manager.lock:
+        try:
+            collect_inventory(metrics, manager)
+        except Exception:
+            logger.error("Failed to collect the inventory of %s", manager.rhvm, exc_info=True)
+            failed += 1
+        # the checks read the inventory just polled, services_status is collected below
+        names = [name for name in CHECKS if name != "services_status"]
+        for name, result in run_checks(manager.system, manager.inventory, names, logger):
+            metrics.add("rhv_check_state", result.state,
+                        "State of the check: 0 ok, 1 warning, 2 critical, 3 unknown",
+                        manager=manager.rhvm, check=name)
+        if services:
+            try:
+                collect_services(metrics, manager, services, workers, host_timeout)
+            except Exception:
+                logger.error("Failed to check the services of %s", manager.rhvm, exc_info=True)
+                failed += 1
+    metrics.add("rhv_collect_errors", failed,
+                "Collections of the last run that failed", manager=manager.rhvm)
+    metrics.add("rhv_collect_duration_seconds", round(time.time() - start, 3),
+                "Seconds the last collection took", manager=manager.rhvm)
+    metrics.add("rhv_collect_timestamp_seconds", round(time.time(), 3),
+                "Time the last collection ended", manager=manager.rhvm)
+
+
+def collect_forever(managers, buffer, interval, logger, services=None, workers=10,
+                    host_timeout=120):
+    while True:
+        start = time.time()
+        metrics = Metrics()
+        for manager in managers.values():
+            try:
+                collect(metrics, manager, services, workers, host_timeout, logger)
+                metrics.add("rhv_up", True, "Whether the manager could be polled",
+                            manager=manager.rhvm)
+            except Exception:
+                logger.error("Failed to collect the metrics of %s", manager.rhvm, exc_info=True)
+                metrics.add("rhv_up", False, "Whether the manager could be polled",
+                            manager=manager.rhvm)
+        buffer.update(metrics)
+        logger.info("Collected the metrics of %s in %.2fs", ", ".join(managers),
+                    time.time() - start)
+        time.sleep(max(0, interval - (time.time() - start)))
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        # scrapes are too frequent for the log
+        pass
+
+    def _send(self, code, body, content_type, encoding=None):
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            return self._send(404, b"Not found, see /metrics\n", "text/plain")
+        openmetrics = "application/openmetrics-text" in self.headers.get("Accept", "")
+        gzipped = "gzip" in self.headers.get("Accept-Encoding", "")
+        body = self.server.buffer.get(openmetrics, gzipped)
+        if body is None:
+            return self._send(503, b"No metrics collected yet\n", "text/plain")
+        self._send(200, body, OPENMETRICS_CONTENT_TYPE if openmetrics else TEXT_CONTENT_TYPE,
+                   "gzip" if gzipped else None)
+
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, buffer):
+        self.buffer = buffer
+        HTTPServer.__init__(self, address, MetricsRequestHandler)
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=RawTextHelpFormatter)
+    parser.add_argument(
+        "-R",
+        "--rhv-manager-url",
+        dest="rhvm",
+        help="Hostname of RHV Manager, repeat for several managers",
+        action="append",
+        required=True,
+    )
+    parser.add_argument(
+        "-u",
+        "--user",
+        dest="user",
+        help="remote user to use",
+        type=str,
+    )
+    parser.add_argument(
+        "-p",
+        "--password",
+        dest="password",
+        help="password for the RHV Manager",
+        type=str
+    )
+    parser.add_argument(
+        "--listen",
+        dest="listen",
+        help="Address and port to serve /metrics on (default 0.0.0.0:9433)",
+        type=str,
+        default="0.0.0.0:9433",
+    )
+    parser.add_argument(
+        "-i",
+        "--collect-interval",
+        dest="collect_interval",
+        help="Seconds between two collections of the metrics",
+        type=float,
+        default=60,
+    )
+    parser.add_argument(
+        "-s",
+        "--services",
+        dest="services",
+        help="Services to check over SSH on every host and their desired state, e.g.\n"
+             "\"{'vdsmd': 'active (running)'}\", none when not given",
+        type=str,
+    )
+    parser.add_argument(
+        "--ssh-workers",
+        dest="ssh_workers",
+        help="Hosts checked concurrently over SSH (default 10)",
+        type=int,
+        default=10,
+    )
+    parser.add_argument(
+        "--host-timeout",
+        dest="host_timeout",
+        help="Seconds to check the services of one host before giving up (default 120)",
+        type=float,
+        default=120,
+    )
+    parser.add_argument(
+        "-l",
+        "--local",
+        dest="local",
+        help="Use this field when testing locally",
+        action="store_true",
+        default=False
+        )
+    args = parser.parse_args()
+    logger = get_logger(args.local)
+    services = json.loads(args.services.replace("'", "\"")) if args.services else None
+
+    # listings stay valid until the next collection
+    managers = {
+        rhvm: Manager(rhvm, args.user, args.password, ttl=2 * args.collect_interval)
+        for rhvm in args.rhvm
+    }
+    buffer = MetricsBuffer()
+    collector = threading.Thread(
+        target=collect_forever, name="collector",
+        args=(managers, buffer, args.collect_interval, logger),
+        kwargs=dict(services=services, workers=args.ssh_workers, host_timeout=args.host_timeout),
+    )
+    collector.daemon = True
+    collector.start()
+
+    host, _, port = args.listen.rpartition(":")
+    server = MetricsServer((host or "0.0.0.0", int(port)), buffer)
+    logger.info("Serving the metrics of %s on %s", ", ".join(managers), args.listen)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -5,28 +5,433 @@ This script performs checks for Red Hat Virtualization(RHV) hosts/Manager throug
 RHV API.
 """
 import argparse
+import functools
 import json
+import logging
+import os
+import socket
 import sys
+import time
 
+from api_stats import by_endpoint
+from api_stats import diff
 from argparse import RawTextHelpFormatter
-from rhv_checks import CHECKS
+from check_result import CheckResult
+from check_result import Perfdata
+from check_result import CRITICAL, OK, STATE_NAMES, UNKNOWN, WARNING
+from check_result import worst_state
+from deadline import Deadline
 from rhv_logconf import get_logger
-from wrapanapi.systems.rhevm import RHEVMSystem
+from status_map import load_status_maps
+
+# rhv_checks, the RHV SDK, the asyncio engine and the caches are only imported when the checks
+# run in this process, not when they are asked from check_rhv_daemon through --socket.
+# paramiko is only imported by the services_status check. See benchmarks/bench_import.py.
+
+
+LOG_LEVELS = {OK: logging.INFO, WARNING: logging.WARNING, CRITICAL: logging.ERROR,
+              UNKNOWN: logging.INFO}
+
+# what the thresholds of each check are compared to, one -w/-c pair can not suit both kinds
+THRESHOLD_KINDS = {
+    "vm_count": "count",
+    "template_count": "count",
+    "locked_disks_count": "count",
+    "vms_distributed_hosts": "count",
+    "storage_domain_usage": "ratio",
+}
 
 
 def get_measurement(measurement):
+    from rhv_checks import CHECKS
     return CHECKS.get(measurement, None)
 
 
+def get_measurements(measurements, services=None):
+    """
+    Turn a comma separated list of measurements (or 'all') into a list of names. 'all' leaves
+    services_status out when no services are given to check.
+    """
+    if measurements.strip() == "all":
+        from rhv_checks import CHECKS
+        return [name for name in CHECKS if services or name != "services_status"]
+    return [name.strip() for name in measurements.split(",") if name.strip()]
+
+
+def split_thresholds(measurements):
+    """
+    Names of 'name[:warning[:critical]]' measurements, and the {name: {"warn": w, "crit": c}}
+    thresholds given that way. Raises ValueError for thresholds that are not numbers.
+    """
+    names, thresholds = [], dict()
+    for measurement in measurements:
+        fields = [field.strip() for field in measurement.split(":")]
+        if len(fields) > 3:
+            raise ValueError("'{}' is not name:warning:critical".format(measurement))
+        names.append(fields[0])
+        values = dict((key, float(value)) for key, value in zip(("warn", "crit"), fields[1:])
+                      if value)
+        if values:
+            thresholds[fields[0]] = values
+    return names, thresholds
+
+
+def get_system(rhvm, user, password):
+    from rhv_system import RHVSystem
+    return RHVSystem(rhvm, user, password, version=4.3)
+
+
+def run_measurement(measure_func, system, logger, engine=None, timeout=None, **kwargs):
+    """
+    Run one check, turning any exception into an UNKNOWN result. With an Engine and a timeout
+    the check is given up on after timeout seconds, and left to end in the background.
+    """
+    import asyncio
+
+    start = time.time()
+    try:
+        if engine is not None and timeout is not None:
+            result = engine.run(
+                engine.call(measure_func, system, logger=logger, timeout=timeout, **kwargs)
+            )
+        else:
+            result = measure_func(system, logger=logger, **kwargs)
+    except asyncio.TimeoutError:
+        logger.error("%s did not finish within the time budget", measure_func.__name__)
+        result = CheckResult(
+            UNKNOWN,
+            "Unknown: '{}' did not finish within the time budget of --timeout".format(
+                measure_func.__name__
+            )
+        )
+    except Exception as e:
+        logger.error(
+            "Exception occurred during execution of %s",
+            measure_func.__name__,
+            exc_info=True
+        )
+        result = CheckResult(
+            UNKNOWN,
+            "ERROR: exception '{}' occurred during execution of '{}', check logs for trace".format(
+                e,
+                measure_func.__name__
+            )
+        )
+    result.timings["total"] = time.time() - start
+    logger.log(LOG_LEVELS[result.state], result.message)
+    return result
+
+
+def run_checks(system, inventory, names, logger, engine=None, timeout=None, thresholds=None,
+               **kwargs):
+    """
+    Run all the named checks over the same system and return (name, CheckResult) pairs. With
+    an Engine the collections the checks read are all fetched concurrently first. With a
+    timeout (seconds), the checks still running when it is spent and the ones not started yet
+    are UNKNOWN, the others are reported as usual. thresholds maps the name of a check to the
+    warn/crit keyword arguments it is given instead of the ones of kwargs.
+    """
+    from rhv_checks import CHECK_COLLECTIONS
+    from rhv_checks import EVENT_TRACKED_CHECKS
+
+    deadline = Deadline(timeout)
+    # the checks aim a little earlier, to report what they collected before being given up on
+    kwargs["deadline"] = Deadline(None if timeout is None else 0.9 * timeout)
+
+    # with a state store these checks only list their objects when the events show a change
+    tracked = EVENT_TRACKED_CHECKS if kwargs.get("state_store") is not None else ()
+    # list every collection the checks need once, up front
+    before_prefetch = inventory.api_stats.snapshot()
+    errors = inventory.prefetch(
+        (collection for name in names if name not in tracked
+         for collection in CHECK_COLLECTIONS.get(name, ())),
+        engine=engine, timeout=kwargs["deadline"].remaining()
+    )
+    for collection, error in errors.items():
+        logger.warning("Failed to fetch %s: %s", collection, error)
+    prefetched = diff(inventory.api_stats.snapshot(), before_prefetch)
+    # the collections listed by this run, not served from memory or the disk cache
+    listed = set(scope for scope, _ in prefetched)
+    results = []
+    for name in names:
+        measure_func = get_measurement(name)
+        if deadline.expired():
+            results.append((name, CheckResult(
+                UNKNOWN, "Unknown: '{}' was not run, the time budget of --timeout was spent "
+                         "by the previous checks".format(measure_func.__name__)
+            )))
+            continue
+        logger.info("Calling check %s", measure_func.__name__)
+        before = inventory.api_stats.snapshot()
+        check_kwargs = dict(kwargs, **(thresholds or {}).get(name, {}))
+        # the calls of the check itself are counted in this inventory, also from the thread
+        # of the engine
+        result = run_measurement(inventory.api_stats.bind(measure_func), system, logger,
+                                 engine=engine, timeout=deadline.remaining(),
+                                 inventory=inventory, **check_kwargs)
+        fetched = inventory.fetched_as(CHECK_COLLECTIONS.get(name, ()))
+        own_calls = diff(inventory.api_stats.snapshot(), before)
+        # API calls of the collections the check read, plus the ones it made itself
+        endpoints = by_endpoint(prefetched, scopes=fetched)
+        by_endpoint(own_calls, into=endpoints)
+        result.timings["endpoints"] = endpoints
+        # time of the API calls of the check itself, 0 when all it read was listed beforehand
+        result.timings["api"] = sum(seconds for _, _, seconds in own_calls.values())
+        # time this run spent listing what the check read up front, 0 when it came from the
+        # listings of a daemon poll, of a previous check or of the disk cache
+        result.timings["prefetch"] = inventory.fetch_time(fetched & listed)
+        result.perfdata.append(Perfdata("api_time", round(result.timings["api"], 3), min=0,
+                                        uom="s"))
+        result.perfdata.append(Perfdata("prefetch_time", round(result.timings["prefetch"], 3),
+                                        min=0, uom="s"))
+        results.append((name, result))
+    return results
+
+
+def check_kwargs(args):
+    """Keyword arguments given to every check from the command line."""
+    kwargs = dict()
+    # thresholds only apply when set, each check has its own sensible defaults otherwise
+    if args.warning is not None:
+        kwargs["warn"] = args.warning
+    if args.critical is not None:
+        kwargs["crit"] = args.critical
+    if args.thresholds:
+        kwargs["thresholds"] = args.thresholds
+    if args.services:
+        kwargs["services"] = json.loads(args.services.replace("'", "\""))
+    if args.ssh_workers is not None:
+        kwargs["workers"] = args.ssh_workers
+    if args.host_timeout is not None:
+        kwargs["host_timeout"] = args.host_timeout
+    if args.status_overrides:
+        kwargs["status_map"] = args.status_overrides
+    if args.track_changes:
+        # replaced by the state store where the checks run
+        kwargs["track_changes"] = True
+    if args.forecast:
+        # replaced by the usage history where the checks run
+        kwargs["forecast"] = True
+    if args.forecast_warning is not None:
+        kwargs["full_warn"] = args.forecast_warning
+    if args.forecast_critical is not None:
+        kwargs["full_crit"] = args.forecast_critical
+    if args.balance_window is not None:
+        kwargs["balance_window"] = args.balance_window
+    if args.timeout is not None:
+        # what is left of the budget when the checks start
+        kwargs["timeout"] = args.deadline.remaining()
+    return kwargs
+
+
+def query_daemon(socket_path, rhvm, names, kwargs, timeout):
+    """
+    Ask check_rhv_daemon to run the checks against its already connected RHV Manager and
+    return (name, CheckResult) pairs.
+    """
+    request = {"manager": rhvm, "measurements": names, "kwargs": kwargs}
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(timeout)
+    try:
+        client.connect(socket_path)
+        client.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        with client.makefile("rb") as stream:
+            response = json.loads(stream.readline().decode("utf-8"))
+    finally:
+        client.close()
+    if "error" in response:
+        raise RuntimeError(response["error"])
+    return [(item["name"], CheckResult.from_dict(item)) for item in response["results"]]
+
+
+def format_multiline(results, with_host=False):
+    """
+    Nagios multi-line output: a summary line followed by one line per (host, name, result),
+    the host is only shown when the results span several RHV Managers. The perfdata of all
+    the checks follows the last line, each label prefixed with its check, e.g.
+    'hosts_status::host_ok=3'.
+    """
+    state = worst_state([result.state for _, _, result in results])
+    counts = {
+        STATE_NAMES[code].lower(): len([r for _, _, r in results if r.state == code])
+        for code in STATE_NAMES
+    }
+    lines = [
+        "{}: {} checks run, {ok} ok, {warning} warning, {critical} critical, {unknown} unknown"
+        .format(STATE_NAMES[state].capitalize(), len(results), **counts)
+    ]
+    perfdata = []
+    for host, name, result in results:
+        label = "{}/{}".format(host, name) if with_host else name
+        lines.append("{} [{}]: {}".format(label, result.state_name, result.message))
+        perfdata.extend(
+            p._replace(label="{}::{}".format(label, p.label)) for p in result.perfdata
+        )
+    output = "\n".join(lines)
+    if perfdata:
+        output += " | " + " ".join(str(p) for p in perfdata)
+    return state, output
+
+
+def format_passive(results):
+    """Shinken/Nagios external commands submitting one passive service result per check."""
+    timestamp = int(time.time())
+    lines = []
+    for host, name, result in results:
+        # the external command format is line based and ';' separated, except for the
+        # perfdata which uses ';' itself
+        message = result.message.replace("\n", " ").replace(";", ",")
+        output = CheckResult(result.state, message, result.perfdata).output()
+        lines.append("[{}] PROCESS_SERVICE_CHECK_RESULT;{};{};{};{}".format(
+            timestamp, host, name, result.state, output
+        ))
+    return "\n".join(lines)
+
+
+def format_profile(results):
+    """
+    Breakdown of the API calls of each (host, name, result) by endpoint, and the time spent in
+    each check. The calls listing a collection read by several checks are shown for each one.
+    """
+    lines = ["{:<40} {:<32} {:>8} {:>10} {:>9}".format(
+        "check", "endpoint", "requests", "KiB", "seconds"
+    )]
+    for host, name, result in results:
+        label = "{}/{}".format(host, name)
+        endpoints = result.timings.get("endpoints") or {}
+        for path, (requests, nbytes, seconds) in sorted(endpoints.items()):
+            lines.append("{:<40} {:<32} {:>8} {:>10.1f} {:>9.3f}".format(
+                label, path, requests, nbytes / 1024.0, seconds
+            ))
+            label = ""
+        lines.append("{:<40} {:<32} {:>8} {:>10} {:>9.3f}".format(
+            label, "(check total)", "", "", result.timings.get("total", 0.0)
+        ))
+    return "\n".join(lines)
+
+
+def get_managers(args):
+    """
+    (rhvm, user, password) of every RHV Manager to check: the comma separated --rhv-manager-url
+    and the lines 'rhvm [user [password]]' of --managers-file, defaulting to --user/--password.
+    """
+    entries = [rhvm.strip() for rhvm in (args.rhvm or "").split(",") if rhvm.strip()]
+    if args.managers_file:
+        with open(args.managers_file, "r") as managers_file:
+            for line in managers_file:
+                line = line.split("#", 1)[0].strip()
+                if line:
+                    entries.append(line)
+    managers = []
+    for entry in entries:
+        fields = entry.split()
+        rhvm = fields[0]
+        user = fields[1] if len(fields) > 1 else args.user
+        password = fields[2] if len(fields) > 2 else args.password
+        managers.append((rhvm, user, password))
+    return managers
+
+
+def run_local(args, logger, names, rhvm, user, password):
+    """Connect to the RHV Manager from this process and run the checks."""
+    from disk_cache import AddressCache
+    from disk_cache import DiskCache
+    from inventory import Inventory
+    from rhv_engine import Engine
+    from ssh_pool import SSHPool
+    from state_store import StateStore
+
+    logger.info("Connecting to RHV %s as user %s", rhvm, user)
+    system = get_system(rhvm, user, password)
+    disk_cache = None
+    address_cache = AddressCache()
+    if args.cache_dir:
+        disk_cache = DiskCache(args.cache_dir, "{}|{}".format(rhvm, user), ttl=args.inventory_ttl)
+        address_cache = AddressCache(os.path.join(disk_cache.directory, "ssh_addresses.json"))
+    inventory = Inventory(system, ttl=args.inventory_ttl, disk_cache=disk_cache)
+    kwargs = check_kwargs(args)
+    state_store = None
+    if kwargs.pop("track_changes", False):
+        # main makes sure there is a cache directory
+        state_store = StateStore(os.path.join(disk_cache.directory, "state.json"))
+    if kwargs.pop("forecast", False):
+        from usage_history import UsageHistory
+        kwargs["usage_history"] = UsageHistory(os.path.join(disk_cache.directory, "usage"))
+    balance_history = None
+    if kwargs.get("balance_window"):
+        from vm_balance import SpreadHistory
+        balance_history = SpreadHistory(os.path.join(disk_cache.directory, "vm_balance.json"))
+        kwargs["balance_history"] = balance_history
+    # SSH connections to the hosts are shared by the checks of this run
+    ssh_pool = SSHPool()
+    engine = Engine()
+    try:
+        return run_checks(system, inventory, names, logger, engine=engine, ssh_pool=ssh_pool,
+                          address_cache=address_cache, state_store=state_store, **kwargs)
+    finally:
+        logger.info("SSH connection pool: %s", ssh_pool.stats())
+        ssh_pool.close()
+        address_cache.save()
+        if state_store is not None:
+            state_store.save()
+        if balance_history is not None:
+            balance_history.save()
+        engine.close()
+
+
+def run_manager(args, logger, names, rhvm, user, password):
+    """(name, CheckResult) pairs of the checks of one RHV Manager."""
+    if args.socket:
+        # the daemon holds the connection and runs the checks
+        kwargs = check_kwargs(args)
+        timeout = args.socket_timeout
+        if args.timeout is not None:
+            # the daemon is done by the deadline, its answer takes a moment to arrive
+            timeout = kwargs["timeout"] + args.margin / 2
+        return query_daemon(args.socket, rhvm, names, kwargs, timeout)
+    return run_local(args, logger, names, rhvm, user, password)
+
+
+def failed_results(args, logger, names, rhvm, error):
+    """UNKNOWN results for all the checks of an RHV Manager that could not be checked."""
+    import asyncio
+
+    if isinstance(error, asyncio.TimeoutError):
+        msg = "Unknown: RHV Manager {} did not answer within {}s".format(
+            rhvm, args.manager_timeout
+        )
+    elif args.socket:
+        msg = "Error: could not get results from check_rhv_daemon at {}: {}".format(
+            args.socket, error
+        )
+    else:
+        msg = "ERROR: exception '{}' occurred while checking RHV Manager {}".format(error, rhvm)
+    logger.error(msg)
+    return [(name, CheckResult(UNKNOWN, msg)) for name in names]
+
+
 def main():
     parser = argparse.ArgumentParser(formatter_class=RawTextHelpFormatter)
     parser.add_argument(
         "-R",
         "--rhv-manager-url",
         dest="rhvm",
-        help="Hostname of RHV Manager",
+        help="Hostname of RHV Manager, comma separated to check several managers in parallel",
+        type=str
+    )
+    parser.add_argument(
+        "--managers-file",
+        dest="managers_file",
+        help="File listing RHV Managers to check, one 'hostname [user [password]]' per line",
         type=str
     )
+    parser.add_argument(
+        "--manager-timeout",
+        dest="manager_timeout",
+        help="Seconds given to each RHV Manager when several are checked",
+        type=float,
+        default=60,
+    )
     parser.add_argument(
         "-u",
         "--user",
@@ -48,13 +453,43 @@ def main():
         help="Type of measurement to carry out",
         type=str
     )
+    parser.add_argument(
+        "-M",
+        "--measurements",
+        dest="measurements",
+        help="Comma separated measurements (or 'all') to run over a single connection, each\n"
+             "one with its own thresholds as name:warning:critical, e.g.\n"
+             "vm_count:20:30,storage_domain_usage:0.8:0.9",
+        type=str
+    )
+    parser.add_argument(
+        "-o",
+        "--output-format",
+        dest="output_format",
+        help="Output of --measurements: 'multiline' plugin output or 'passive' check results,\n"
+             "passive by default when several RHV Managers are checked",
+        choices=["multiline", "passive"],
+    )
+    parser.add_argument(
+        "-H",
+        "--host-name",
+        dest="host_name",
+        help="Host name the passive check results are submitted for, defaults to the RHV Manager\n"
+             "(ignored with several managers, each one's results go to its own host)",
+        type=str
+    )
+    parser.add_argument(
+        "--command-file",
+        dest="command_file",
+        help="Append passive check results to this external command file instead of printing",
+        type=str
+    )
     parser.add_argument(
         "-w",
         "--warning",
         dest="warning",
         help="Warning value. Could be fraction or whole number.",
         type=float,
-        default=0.75,
     )
     parser.add_argument(
         "-c",
@@ -62,7 +497,57 @@ def main():
         dest="critical",
         help="Critical value. Could be fraction or whole number.",
         type=float,
-        default=0.9,
+    )
+    parser.add_argument(
+        "--ssh-workers",
+        dest="ssh_workers",
+        help="Number of hosts services_status checks at the same time (default 10)",
+        type=int,
+    )
+    parser.add_argument(
+        "--host-timeout",
+        dest="host_timeout",
+        help="Seconds services_status may spend on one host before reporting it (default 120)",
+        type=float,
+    )
+    parser.add_argument(
+        "--inventory-ttl",
+        dest="inventory_ttl",
+        help="Seconds the hosts/storage domains/datacenters listings are reused between checks",
+        type=float,
+        default=60,
+    )
+    parser.add_argument(
+        "--cache-dir",
+        dest="cache_dir",
+        help="Directory where the listings are cached for --inventory-ttl seconds and shared\n"
+             "between plugin invocations, e.g. /var/cache/check-rhv",
+        type=str,
+    )
+    parser.add_argument(
+        "-S",
+        "--socket",
+        dest="socket",
+        help="Unix socket of a running check_rhv_daemon to ask for the results instead of\n"
+             "connecting to the RHV Manager from this process",
+        type=str,
+    )
+    parser.add_argument(
+        "--socket-timeout",
+        dest="socket_timeout",
+        help="Seconds to wait for check_rhv_daemon to answer",
+        type=float,
+        default=60,
+    )
+    parser.add_argument(
+        "-t",
+        "--timeout",
+        dest="timeout",
+        help="Seconds the whole run may take, e.g. the timeout of the service check in\n"
+             "Shinken. The API listings, the checks and the SSH connections to the hosts\n"
+             "share it, the checks not done in time are UNKNOWN with the results collected\n"
+             "so far. A second (a tenth of shorter budgets) is kept to print the results",
+        type=float,
     )
     parser.add_argument(
         "-l",
@@ -76,54 +561,255 @@ def main():
         "-s",
         "--services",
         dest="services",
-        help="Dictionary of services and their expected statuses",
+        help="Dictionary of services and their expected statuses, each one the 'Loaded:' or\n"
+             "'Active:' line of systemctl status or its start, a state or a unit file path,\n"
+             "e.g. \"{'vdsmd': 'Active: active (running)', 'ovirt-ha-agent': 'enabled'}\"",
+        type=str,
+    )
+    parser.add_argument(
+        "--status-map",
+        dest="status_map",
+        help="INI file overriding the state of host, datacenter and storage domain statuses,\n"
+             "e.g. a [host] section with 'maintenance = ok'",
+        type=str,
+    )
+    parser.add_argument(
+        "--track-changes",
+        dest="track_changes",
+        help="Report the changes of status since the previous run instead of the status of\n"
+             "all the objects, and only list hosts, datacenters and storage domains when the\n"
+             "events of the engine show a change. Needs --cache-dir, or --socket",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--forecast",
+        dest="forecast",
+        help="Keep the history of the usage of the storage domains and alert on the days\n"
+             "left until they are full at their growth rate of the last week\n"
+             "(storage_domain_usage). Needs --cache-dir, or --socket and a daemon started\n"
+             "with --history-dir",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--forecast-warning",
+        dest="forecast_warning",
+        help="Days left until a storage domain is full to warn at (default 30)",
+        type=float,
+    )
+    parser.add_argument(
+        "--forecast-critical",
+        dest="forecast_critical",
+        help="Days left until a storage domain is full to be critical at (default 7)",
+        type=float,
+    )
+    parser.add_argument(
+        "--balance-window",
+        dest="balance_window",
+        help="Seconds a cluster must stay unbalanced before vms_distributed_hosts alerts.\n"
+             "Needs --cache-dir, or --socket",
+        type=float,
+    )
+    parser.add_argument(
+        "--profile",
+        dest="profile",
+        help="Print the API requests, bytes and time of each check per endpoint on stderr",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--profile-output",
+        dest="profile_output",
+        help="Also write cProfile statistics of the run to this file (main thread only),\n"
+             "to read with python -m pstats",
         type=str,
     )
     args = parser.parse_args()
+    # the budget starts now, less the time kept to print the results
+    args.margin = 0.0 if args.timeout is None else min(1.0, args.timeout / 10)
+    args.deadline = Deadline(None if args.timeout is None else args.timeout - args.margin)
     # set logger
     logger = get_logger(args.local)
 
-    if args.warning > args.critical:
-        msg = "Error: warning value can not be greater than critical value"
+    profiler = None
+    if args.profile_output:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    args.status_overrides = None
+    if args.status_map:
+        try:
+            args.status_overrides = load_status_maps(args.status_map)
+        except (OSError, ValueError) as e:
+            msg = "Error: could not read status map: {}".format(e)
+            logger.error(msg)
+            print(msg)
+            sys.exit(3)
+
+    if args.track_changes and not (args.cache_dir or args.socket):
+        msg = "Error: --track-changes needs --cache-dir to keep the state between runs"
         logger.error(msg)
         print(msg)
         sys.exit(3)
 
-    # connect to the system
-    logger.info("Connecting to RHV %s as user %s", args.rhvm, args.user)
-    system = RHEVMSystem(args.rhvm, args.user, args.password, version=4.3)
-    # get measurement function
-    measure_func = get_measurement(args.measurement)
-    if not measure_func:
-        msg = "Error: measurement {} not understood".format(args.measurement)
+    if args.balance_window and not (args.cache_dir or args.socket):
+        msg = "Error: --balance-window needs --cache-dir to keep the samples of the window"
         logger.error(msg)
         print(msg)
         sys.exit(3)
 
-    # run the measurement function
-    # if warning and critical values are not set, we need to use the default and not pass them
-    try:
-        logger.info("Calling check %s", measure_func.__name__)
-        if args.services:
-            measure_func(system,
-                         logger=logger,
-                         services=json.loads(args.services.replace("'", "\"")))
-        else:
-            measure_func(system, warn=args.warning, crit=args.critical, logger=logger)
-    except Exception as e:
-        logger.error(
-            "Exception occurred during execution of %s",
-            measure_func.__name__,
-            exc_info=True
-        )
-        print(
-            "ERROR: exception '{}' occurred during execution of '{}', check logs for trace".format(
-                e,
-                measure_func.__name__
+    if args.forecast and not (args.cache_dir or args.socket):
+        msg = "Error: --forecast needs --cache-dir to keep the usage history"
+        logger.error(msg)
+        print(msg)
+        sys.exit(3)
+
+    if not args.measurements:
+        # single measurement mode keeps the historical default thresholds
+        if args.warning is None:
+            args.warning = 0.75
+        if args.critical is None:
+            args.critical = 0.9
+
+    if args.warning is not None and args.critical is not None and args.warning > args.critical:
+        msg = "Error: warning value can not be greater than critical value"
+        logger.error(msg)
+        print(msg)
+        sys.exit(3)
+
+    args.thresholds = dict()
+    if args.measurements:
+        try:
+            names, args.thresholds = split_thresholds(
+                name for name in args.measurements.split(",") if name.strip()
+            )
+        except ValueError as e:
+            msg = "Error: could not read the thresholds of --measurements: {}".format(e)
+            logger.error(msg)
+            print(msg)
+            sys.exit(3)
+    else:
+        names = [args.measurement]
+
+    for name, values in args.thresholds.items():
+        warn = values.get("warn", args.warning)
+        crit = values.get("crit", args.critical)
+        if name not in THRESHOLD_KINDS:
+            msg = "Error: {} does not take thresholds".format(name)
+        elif warn is not None and crit is not None and warn > crit:
+            msg = "Error: warning value of {} can not be greater than its critical value".format(
+                name
             )
+        else:
+            continue
+        logger.error(msg)
+        print(msg)
+        sys.exit(3)
+
+    if args.measurements and (args.warning is not None or args.critical is not None):
+        # the checks given both thresholds of their own do not use -w/-c
+        kinds = set(
+            THRESHOLD_KINDS[name] for name in (THRESHOLD_KINDS if names == ["all"] else names)
+            if name in THRESHOLD_KINDS and len(args.thresholds.get(name, ())) < 2
         )
+        if len(kinds) > 1:
+            msg = ("Error: -w/-c can not suit both counts and ratios, give the thresholds of "
+                   "each check as name:warning:critical")
+            logger.error(msg)
+            print(msg)
+            sys.exit(3)
+
+    managers = get_managers(args)
+    if not managers:
+        msg = "Error: no RHV Manager given"
+        logger.error(msg)
+        print(msg)
         sys.exit(3)
 
+    if not args.socket:
+        # the daemon validates the names itself
+        if names == ["all"]:
+            names = get_measurements("all", services=args.services)
+        unknown = [name for name in names if not get_measurement(name)]
+        if unknown or not names:
+            msg = "Error: measurement(s) {} not understood".format(", ".join(map(str, unknown)))
+            logger.error(msg)
+            print(msg)
+            sys.exit(3)
+
+    if "services_status" in names and not args.services:
+        msg = "Error: services_status needs the services to check, given with --services"
+        logger.error(msg)
+        print(msg)
+        sys.exit(3)
+
+    if args.services:
+        from utils import expected_properties
+        try:
+            for status in json.loads(args.services.replace("'", "\"")).values():
+                expected_properties(status)
+        except (ValueError, AttributeError) as e:
+            msg = "Error: could not read --services: {}".format(e)
+            logger.error(msg)
+            print(msg)
+            sys.exit(3)
+
+    if len(managers) == 1:
+        rhvm, user, password = managers[0]
+        try:
+            results = {rhvm: run_manager(args, logger, names, rhvm, user, password)}
+        except Exception as e:
+            results = {rhvm: failed_results(args, logger, names, rhvm, e)}
+    else:
+        # every manager runs in parallel with its own deadline, a dead one only fails its checks
+        from rhv_engine import Engine
+
+        args.manager_timeout = args.deadline.timeout(args.manager_timeout)
+        with Engine(max_workers=len(managers)) as engine:
+            outcomes = engine.gather_dict({
+                rhvm: functools.partial(run_manager, args, logger, names, rhvm, user, password)
+                for rhvm, user, password in managers
+            }, timeout=args.manager_timeout)
+        results = dict()
+        for rhvm, outcome in outcomes.items():
+            if isinstance(outcome, BaseException):
+                outcome = failed_results(args, logger, names, rhvm, outcome)
+            results[rhvm] = outcome
+
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.profile_output)
+    if args.profile or profiler is not None:
+        sys.stderr.write(format_profile([
+            (rhvm, name, result) for rhvm, _, _ in managers for name, result in results[rhvm]
+        ]) + "\n")
+
+    if not args.measurements and len(managers) == 1:
+        result = results[managers[0][0]][0][1]
+        print(result.output())
+        sys.exit(result.state)
+
+    # results tagged with the host they are submitted for
+    tagged = []
+    for rhvm, _, _ in managers:
+        host = args.host_name if len(managers) == 1 and args.host_name else rhvm
+        tagged.extend((host, name, result) for name, result in results[rhvm])
+    output_format = args.output_format or ("passive" if len(managers) > 1 else "multiline")
+    state, output = format_multiline(tagged, with_host=len(managers) > 1)
+    if output_format == "passive":
+        passive = format_passive(tagged)
+        if args.command_file:
+            with open(args.command_file, "a") as command_file:
+                command_file.write(passive + "\n")
+            # the summary goes to the plugin output
+            output = output.splitlines()[0]
+        else:
+            output = passive
+    print(output)
+    sys.exit(state)
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,30 @@
+# coding: utf-8
+"""
+Time budget of a run (--timeout), shared by the API listings, the checks and the SSH
+connections to the hosts: each call is given at most what is left of it, so the results
+collected so far are reported before the scheduler kills the plugin.
+"""
+import time
+
+
+class Deadline(object):
+    """Point in time the work must be done by, never when ``seconds`` is None."""
+
+    def __init__(self, seconds=None):
+        self.expires = None if seconds is None else time.time() + max(0.0, float(seconds))
+
+    def remaining(self):
+        """Seconds left, None without a budget."""
+        if self.expires is None:
+            return None
+        return max(0.0, self.expires - time.time())
+
+    def expired(self):
+        return self.expires is not None and time.time() >= self.expires
+
+    def timeout(self, limit=None):
+        """limit capped by the seconds left, e.g. for a socket timeout, None for no limit."""
+        remaining = self.remaining()
+        if remaining is None or limit is None:
+            return limit if remaining is None else remaining
+        return min(limit, remaining)
@@ -0,0 +1,140 @@
+# coding: utf-8
+"""
+On-disk cache of RHV Manager listings, shared by all the plugin processes checking the same
+manager. Entries are written atomically and refreshed under a file lock, so concurrent checks
+cost a single request to the RHV API.
+"""
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import threading
+import time
+import zlib
+
+from contextlib import contextmanager
+
+
+def atomic_write(path, data):
+    """Write data to a temporary file next to path and rename it over path."""
+    directory, name = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".{}.".format(name))
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            tmp_file.write(data)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.rename(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+class DiskCache(object):
+    """
+    Directory of zlib compressed pickles, one per collection of one RHV Manager. The directory
+    is created private to the user running the checks, as pickles must only be loaded from a
+    trusted location.
+    """
+
+    def __init__(self, directory, namespace, ttl=60):
+        digest = hashlib.sha1(namespace.encode("utf-8")).hexdigest()
+        self.directory = os.path.join(directory, digest)
+        self.ttl = ttl
+        try:
+            os.makedirs(self.directory, mode=0o700)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        # an existing directory could have been made by another user to have us load their pickles
+        stat = os.stat(self.directory)
+        if stat.st_uid != os.getuid() or stat.st_mode & 0o077:
+            raise OSError(
+                errno.EPERM, "cache directory must be owned by the user running the checks and "
+                "not accessible to the others", self.directory
+            )
+
+    def _path(self, key):
+        return os.path.join(self.directory, "{}.cache".format(key))
+
+    def load(self, key):
+        """The cached value of key or None if missing, unreadable or older than the ttl."""
+        try:
+            with open(self._path(key), "rb") as cache_file:
+                timestamp, value = pickle.loads(zlib.decompress(cache_file.read()))
+        except (IOError, OSError, EOFError, ValueError, zlib.error, pickle.UnpicklingError):
+            return None
+        if time.time() - timestamp >= self.ttl:
+            return None
+        return value
+
+    def store(self, key, value):
+        data = zlib.compress(pickle.dumps((time.time(), value), pickle.HIGHEST_PROTOCOL))
+        atomic_write(self._path(key), data)
+
+    @contextmanager
+    def lock(self, key):
+        with open(os.path.join(self.directory, "{}.lock".format(key)), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get(self, key, fetch):
+        """Cached value of key, calling fetch to refresh it when it is missing or expired."""
+        value = self.load(key)
+        if value is not None:
+            return value
+        with self.lock(key):
+            # another process may have refreshed the entry while we waited for the lock
+            value = self.load(key)
+            if value is None:
+                value = fetch()
+                self.store(key, value)
+        return value
+
+
+class AddressCache(object):
+    """
+    Address each host last answered SSH on, so the next runs try it first without listing
+    the NICs of the host. Kept in memory only when no path is given.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._addresses = dict()
+        self._changed = False
+        self._lock = threading.Lock()
+        if path is not None:
+            try:
+                with open(path, "r") as cache_file:
+                    self._addresses = json.load(cache_file)
+            except (IOError, OSError, ValueError):
+                pass
+
+    def get(self, host_id):
+        with self._lock:
+            return self._addresses.get(host_id)
+
+    def set(self, host_id, address):
+        with self._lock:
+            if self._addresses.get(host_id) != address:
+                self._addresses[host_id] = address
+                self._changed = True
+
+    def forget(self, host_id):
+        with self._lock:
+            if self._addresses.pop(host_id, None) is not None:
+                self._changed = True
+
+    def save(self):
+        with self._lock:
+            if self.path is None or not self._changed:
+                return
+            data = json.dumps(self._addresses, sort_keys=True).encode("utf-8")
+            self._changed = False
+        atomic_write(self.path, data)
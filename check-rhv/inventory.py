@@ -0,0 +1,332 @@
+# coding: utf-8
+"""
+Snapshot of the RHV Manager collections (hosts, storage domains, datacenters) shared by the
+checks, so each collection is listed once per cycle no matter how many checks read it.
+"""
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from ovirtsdk4 import types
+
+from api_stats import ApiStats
+from api_stats import instrument
+from rhv_stream import Field
+from rhv_stream import authenticate
+from rhv_stream import stream_records
+from rhv_stream import to_bool
+
+# fields the checks read from the hosts, storage domains and datacenters, only these are kept
+# from the listings
+HOST_FIELDS = (
+    Field("id", "@id"),
+    Field("name"),
+    Field("status", convert=types.HostStatus),
+    Field("summary_total", "summary/total", int),
+    Field("cluster_id", "cluster/@id"),
+    Field("cpu_sockets", "cpu/topology/sockets", int),
+    Field("cpu_cores", "cpu/topology/cores", int),
+    Field("cpu_threads", "cpu/topology/threads", int),
+    Field("memory", convert=int),
+)
+# the hosted_engine details are only sent with all_content
+HOST_ALL_CONTENT_FIELDS = HOST_FIELDS + (
+    Field("hosted_engine_configured", "hosted_engine/configured", to_bool),
+    Field("hosted_engine_active", "hosted_engine/active", to_bool),
+    Field("hosted_engine_local_maintenance", "hosted_engine/local_maintenance", to_bool),
+    Field("hosted_engine_global_maintenance", "hosted_engine/global_maintenance", to_bool),
+    Field("hosted_engine_score", "hosted_engine/score", int),
+)
+STORAGE_DOMAIN_FIELDS = (
+    Field("id", "@id"),
+    Field("name"),
+    Field("type", convert=types.StorageDomainType),
+    Field("external_status", convert=types.ExternalStatus),
+    Field("used", convert=int),
+    Field("available", convert=int),
+)
+DATA_CENTER_FIELDS = (
+    Field("id", "@id"),
+    Field("name"),
+    Field("status", convert=types.DataCenterStatus),
+)
+CLUSTER_FIELDS = (
+    Field("id", "@id"),
+    Field("name"),
+)
+# a storage domain as listed below a datacenter, with its status in it
+ATTACHED_STORAGE_DOMAIN_FIELDS = (
+    Field("id", "@id"),
+    Field("name"),
+    Field("type", convert=types.StorageDomainType),
+    Field("status", convert=types.StorageDomainStatus),
+)
+# the storage domains of the disks of a VM listed following its disk attachments
+VM_FIELDS = (
+    Field("id", "@id"),
+    Field("storage_domain_ids",
+          "disk_attachments/disk_attachment/disk/storage_domains/storage_domain/@id",
+          multiple=True),
+)
+TEMPLATE_FIELDS = (
+    Field("id", "@id"),
+)
+DISK_FIELDS = (
+    Field("id", "@id"),
+)
+# datacenters whose attached storage domains are listed at the same time
+ATTACHED_WORKERS = 8
+# events read at once by events_since, more mean too much changed to rely on them
+EVENTS_MAX = 1000
+
+
+def _link_id(link):
+    return link.id if link is not None else None
+
+
+class Inventory(object):
+    """
+    Collections of one RHV Manager, each fetched on first use and served from memory until
+    it is older than ``ttl`` seconds. The listings are streamed into records holding only
+    the fields above. With a DiskCache the listings are also
+    shared with the other processes checking the same manager. The API calls are counted in
+    ``api_stats`` under the name of the collection they fetch.
+    """
+
+    def __init__(self, system, ttl=60, disk_cache=None):
+        self.system = system
+        self.ttl = ttl
+        self.disk_cache = disk_cache
+        self._cache = dict()
+        # seconds the last fetch of each collection took
+        self._fetch_times = dict()
+        self._connection = None
+        self._lock = threading.Lock()
+        self._key_locks = dict()
+        self.api_stats = ApiStats()
+
+    @property
+    def connection(self):
+        # the connection of the system, instrumented once to count its API calls
+        with self._lock:
+            if self._connection is None:
+                self._connection = instrument(self.system.api, self.api_stats)
+            connection = self._connection
+        # logged in once, before the listings run concurrently
+        authenticate(connection)
+        return connection
+
+    @property
+    def system_service(self):
+        return self.connection.system_service()
+
+    def _cached(self, key):
+        entry = self._cache.get(key)
+        if entry is not None and time.time() - entry[0] < self.ttl:
+            return entry[1]
+        return None
+
+    def _get(self, key, fetch):
+        value = self._cached(key)
+        if value is not None:
+            return value
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        # collections can be fetched from several threads, each one is fetched only once
+        with key_lock:
+            value = self._cached(key)
+            if value is None:
+                start = time.time()
+                with self.api_stats.scope(key):
+                    if self.disk_cache is not None:
+                        value = self.disk_cache.get(key, fetch)
+                    else:
+                        value = fetch()
+                self._fetch_times[key] = time.time() - start
+                self._cache[key] = (time.time(), value)
+        return value
+
+    def fetched_as(self, collections):
+        """The collections (see prefetch) that were actually fetched to serve the named ones."""
+        fetched = set()
+        for collection in collections:
+            if collection == "hosts" and collection not in self._fetch_times:
+                # served by the listing with all the content
+                collection = "hosts_all_content"
+            fetched.add(collection)
+        return fetched
+
+    def fetch_time(self, collections):
+        """Seconds spent fetching the named collections by this inventory."""
+        return sum(self._fetch_times.get(c, 0.0) for c in self.fetched_as(collections))
+
+    def invalidate(self):
+        self._cache.clear()
+        self._connection = None
+
+    def inherit(self, previous):
+        """
+        Serve the listings of a previous inventory that this one did not fetch, e.g. the ones
+        a poll failed to refresh, until they expire.
+        """
+        now = time.time()
+        for key, entry in previous._cache.items():
+            if key not in self._cache and now - entry[0] < self.ttl:
+                self._cache[key] = entry
+                self._fetch_times[key] = previous._fetch_times.get(key, 0.0)
+
+    def hosts(self, all_content=False):
+        """Hosts, with all their details (e.g. hosted_engine) when ``all_content`` is set."""
+        if not all_content:
+            # a listing with all the content serves the plain one as well
+            hosts = self._cached("hosts_all_content")
+            if hosts is not None:
+                return hosts
+            return self._get(
+                "hosts", lambda: list(stream_records(self.connection, "/hosts", HOST_FIELDS))
+            )
+        return self._get(
+            "hosts_all_content",
+            lambda: list(stream_records(
+                self.connection, "/hosts", HOST_ALL_CONTENT_FIELDS, all_content=True
+            ))
+        )
+
+    def storage_domains(self):
+        return self._get(
+            "storage_domains",
+            lambda: list(stream_records(
+                self.connection, "/storagedomains", STORAGE_DOMAIN_FIELDS
+            ))
+        )
+
+    def data_centers(self):
+        return self._get(
+            "data_centers",
+            lambda: list(stream_records(self.connection, "/datacenters", DATA_CENTER_FIELDS))
+        )
+
+    def clusters(self):
+        return self._get(
+            "clusters",
+            lambda: list(stream_records(self.connection, "/clusters", CLUSTER_FIELDS))
+        )
+
+    def attached_storage_domains(self):
+        """
+        Storage domains attached to each datacenter, with their status in it, keyed by
+        datacenter id. The listings of all the datacenters are streamed concurrently, counted
+        in the stats of the check asking for them.
+        """
+        def fetch_one(dc_id):
+            return list(stream_records(
+                self.connection, "/datacenters/{}/storagedomains".format(dc_id),
+                ATTACHED_STORAGE_DOMAIN_FIELDS
+            ))
+
+        def fetch():
+            dc_ids = [dc.id for dc in self.data_centers()]
+            if not dc_ids:
+                return dict()
+            with ThreadPoolExecutor(max_workers=min(ATTACHED_WORKERS, len(dc_ids))) as pool:
+                return dict(zip(dc_ids, pool.map(self.api_stats.bind(fetch_one), dc_ids)))
+        return self._get("attached_storage_domains", fetch)
+
+    def vm_counts_by_storage_domain(self):
+        """
+        Number of VMs with at least one disk on each storage domain, keyed by storage domain
+        id, from a single listing of the VMs following their disks.
+        """
+        def fetch():
+            counts = dict()
+            vms = stream_records(self.connection, "/vms", VM_FIELDS,
+                                 follow="disk_attachments.disk")
+            for vm in vms:
+                for sd_id in set(vm.storage_domain_ids):
+                    counts[sd_id] = counts.get(sd_id, 0) + 1
+            return counts
+        return self._get("vm_counts_by_storage_domain", fetch)
+
+    def events_since(self, event_id):
+        """
+        (id, host id, storage domain id, datacenter id) of the events of the engine after
+        event_id, at most EVENTS_MAX of them, or of the latest event when event_id is None.
+        """
+        def fetch():
+            events_service = self.system_service.events_service()
+            if event_id is None:
+                events = events_service.list(max=1)
+            else:
+                events = events_service.list(from_=int(event_id), max=EVENTS_MAX)
+            return [
+                (int(event.id), _link_id(event.host), _link_id(event.storage_domain),
+                 _link_id(event.data_center))
+                for event in events
+            ]
+        return self._get("events_since_{}".format(event_id), fetch)
+
+    def summary(self):
+        """Totals of the API entry point (VMs, hosts, storage domains...), a single small GET."""
+        return self._get("summary", lambda: self.system_service.get().summary)
+
+    def vm_count(self):
+        return self.summary().vms.total
+
+    def template_count(self):
+        # the 'Blank' template is filtered out by the engine, as wrapanapi does locally, and
+        # only the id of the others is read from the stream
+        return self._get(
+            "template_count",
+            lambda: sum(1 for _ in stream_records(
+                self.connection, "/templates", TEMPLATE_FIELDS, search="name!=Blank"
+            ))
+        )
+
+    def locked_disk_count(self):
+        # only the locked disks are sent back by the engine, and only their id is read
+        return self._get(
+            "locked_disk_count",
+            lambda: sum(1 for _ in stream_records(
+                self.connection, "/disks", DISK_FIELDS, search="status=locked"
+            ))
+        )
+
+    def prefetch(self, collections, engine=None, timeout=None):
+        """
+        Fetch the named collections, e.g. the ones a batch of checks is going to read, all at
+        once when an Engine is given, waiting for them at most timeout seconds then. Failures
+        are left for the checks to report, they are returned as a dict of the exception raised
+        for each failed collection.
+        """
+        collections = set(collections)
+        if "hosts_all_content" in collections:
+            collections.discard("hosts")
+        collections = sorted(collections)
+        fetches = []
+        for collection in collections:
+            if collection == "hosts_all_content":
+                fetches.append(lambda: self.hosts(all_content=True))
+            else:
+                fetches.append(getattr(self, collection))
+        if engine is not None:
+            results = engine.gather(fetches, timeout=timeout)
+        else:
+            results = []
+            for fetch in fetches:
+                try:
+                    results.append(fetch())
+                except Exception as e:
+                    results.append(e)
+        return {
+            collection: result for collection, result in zip(collections, results)
+            if isinstance(result, BaseException)
+        }
+
+
+def get_inventory(system, kwargs):
+    """The inventory passed to a check, or a fresh one when the check is run on its own."""
+    inventory = kwargs.get("inventory")
+    if inventory is None:
+        inventory = Inventory(system)
+    return inventory
@@ -1,128 +1,147 @@
 # coding: utf-8
 """
 These are the functions to check RHV manager/hosts through the
-RHV API
+RHV API. Each of them returns a CheckResult, check_rhv_main maps it to the exit code.
 """
 from __future__ import division
 
-import sys
+import socket
+
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
 
 from ovirtsdk4 import types
 
-from utils import is_service_in_status
+from check_result import CheckResult
+from check_result import Perfdata
+from check_result import CRITICAL, OK, UNKNOWN, WARNING
+from deadline import Deadline
+from inventory import EVENTS_MAX
+from inventory import get_inventory
+from rhv_stream import record_type
+from ssh_pool import SSHPool
+from status_map import classify
+from status_map import format_transitions
+from status_map import status_map
+from status_map import status_result
+from status_map import status_text
+from utils import expected_properties
+from utils import is_in_status
+from utils import services_properties
 from utils import ssh_client
 
 
 def check_vm_count(system, warn=20, crit=30, **kwargs):
     """ Check count of VMs. """
-    logger = kwargs["logger"]
     warn = int(warn)
     crit = int(crit)
-    vm_count = len(system.list_vms())
+    vm_count = get_inventory(system, kwargs).vm_count()
+    perfdata = [Perfdata("vms", vm_count, warn, crit, 0)]
     # determine ok, warning, critical, unknown state
     if vm_count < warn:
         msg = ("Ok: VM count is less than {}. VM Count = {}".format(warn, vm_count))
-        logger.info(msg)
-        print(msg)
-        sys.exit(0)
+        return CheckResult(OK, msg, perfdata)
     elif warn <= vm_count <= crit:
         msg = ("Warning: VM count is greater than {} & less than {}. VM Count = {}"
             .format(warn, crit, vm_count))
-        logger.warning(msg)
-        print(msg)
-        sys.exit(1)
+        return CheckResult(WARNING, msg, perfdata)
     elif vm_count > crit:
         msg = ("Critical: VM count is greater than {}. VM Count = {}".format(crit, vm_count))
-        logger.error(msg)
-        print(msg)
-        sys.exit(2)
+        return CheckResult(CRITICAL, msg, perfdata)
     else:
         msg = ("Unknown: VM count is unknown")
-        logger.info(msg)
-        print(msg)
-        sys.exit(3)
+        return CheckResult(UNKNOWN, msg, perfdata)
 
 
 def check_template_count(system, warn=20, crit=30, **kwargs):
     """ Check count of templates. """
-    logger = kwargs["logger"]
     warn = int(warn)
     crit = int(crit)
-    template_count = len(system.list_templates())
+    template_count = get_inventory(system, kwargs).template_count()
+    perfdata = [Perfdata("templates", template_count, warn, crit, 0)]
     # determine ok, warning, critical, unknown state
     if template_count < warn:
         msg = ("Ok: Template count is less than {}. Template Count = {}".format(warn, template_count))
-        logger.info(msg)
-        print(msg)
-        sys.exit(0)
+        return CheckResult(OK, msg, perfdata)
     elif warn <= template_count <= crit:
         msg = ("Warning: Template count is greater than {} & less than {}. Template Count = {}"
             .format(warn, crit, template_count))
-        logger.warning(msg)
-        print(msg)
-        sys.exit(1)
+        return CheckResult(WARNING, msg, perfdata)
     elif template_count > crit:
         msg = ("Critical: Template count is greater than {}. Template Count = {}".format(crit, template_count))
-        logger.error(msg)
-        print(msg)
-        sys.exit(2)
+        return CheckResult(CRITICAL, msg, perfdata)
     else:
         msg = ("Unknown: Template count is unknown")
-        logger.info(msg)
-        print(msg)
-        sys.exit(3)
+        return CheckResult(UNKNOWN, msg, perfdata)
+
+
+def _tracked_objects(inventory, state_store, kind, list_objects, attribute):
+    """
+    The objects of kind as records of their id, name and status (as text), the id of the
+    last event of the engine and whether they were listed. They are rebuilt from the state
+    store instead of listed when no event since the previous run concerns any of them.
+    """
+    since = state_store.event_id(kind)
+    # the events are read before listing, a change made meanwhile shows in the next run
+    events = inventory.events_since(since)
+    event_id = max([event[0] for event in events] + [since or 0]) or None
+    stored = state_store.objects(kind)
+    record = record_type(("id", "name", attribute))
+    if (since is not None and stored is not None and not state_store.needs_listing(kind)
+            and len(events) < EVENTS_MAX
+            and not any(event[EVENT_LINKS[kind]] for event in events)):
+        return [record(object_id, name, status)
+                for object_id, (name, status) in stored.items()], event_id, False
+    return [
+        record(obj.id, obj.name, status_text(getattr(obj, attribute))) for obj in list_objects()
+    ], event_id, True
+
+
+def _status_check(system, kwargs, kind, label, list_objects, attribute="status"):
+    """
+    Classify the objects listed by list_objects(inventory) with the status table of kind.
+    With a state_store only the changes since the previous run are reported.
+    """
+    inventory = get_inventory(system, kwargs)
+    table = status_map(kind, kwargs.get("status_map"))
+    state_store = kwargs.get("state_store")
+    if state_store is None:
+        return status_result(label, *classify(list_objects(inventory), table, attribute))
+
+    objects, event_id, listed = _tracked_objects(
+        inventory, state_store, kind, lambda: list_objects(inventory), attribute
+    )
+    by_state, all_items = classify(objects, table, attribute)
+    transitions = state_store.update(
+        kind, {obj.id: (obj.name, getattr(obj, attribute)) for obj in objects},
+        event_id=event_id, listed=listed
+    )
+    return status_result(label, by_state, all_items, transitions)
 
 
 def check_storage_domain_status(system, **kwargs):
     """ Check the usage of all the datastores on the host. """
-    logger = kwargs["logger"]
-    okay, warning, critical, unknown, all_items = [], [], [], [], []
-    storage_domains = system.api.system_service().storage_domains_service().list()
-
-    for storage_domain in storage_domains:
-        status = storage_domain.external_status
-        if status == types.ExternalStatus.OK:
-            okay.append((storage_domain.name, status))
-        elif status == types.ExternalStatus.WARNING:
-            warning.append((storage_domain.name, status))
-        elif status == types.ExternalStatus.FAILURE or status == types.ExternalStatus.ERROR:
-            critical.append((storage_domain.name, status))
-        else:
-            unknown.append((storage_domain.name, status))
-        all_items.append((storage_domain.name, status))
+    return _status_check(system, kwargs, "storage_domain", "storage_domain",
+                         lambda inventory: inventory.storage_domains(),
+                         attribute="external_status")
 
-    if critical:
-        msg = ("Critical: the following storage_domain(s) definitely have an issue: {}\n "
-               "Status of all storage_domain is: {}".format(critical, all_items))
-        logger.error(msg)
-        print(msg)
-        sys.exit(2)
-    elif warning:
-        msg = ("Warning: the following storage_domain(s) may have an issue: {}\n "
-               "Status of all storage_domain is: {}".format(warning, all_items))
-        logger.warning(msg)
-        print(msg)
-        sys.exit(1)
-    elif unknown:
-        msg = ("Unknown: the following storage_domain(s) are in an unknown state: {}\n"
-               "Status of all storage_domain is: {}".format(unknown, all_items))
-        logger.info(msg)
-        print(msg)
-        sys.exit(3)
-    else:
-        msg = ("Ok: all storage_domain(s) are in the OK state: {}".format(okay))
-        logger.info(msg)
-        print(msg)
-        sys.exit(0)
 
-
-def check_storage_domain_usage(system, warn=0.75, crit=0.9, **kwargs):
-    """ Check the usage of all the datastores on the host. """
-    logger = kwargs["logger"]
+def check_storage_domain_usage(system, warn=0.75, crit=0.9, full_warn=30, full_crit=7,
+                               **kwargs):
+    """
+    Check the usage of all the datastores on the host. With a usage_history, also check the
+    number of days left until each one is full at its current growth rate.
+    """
     warn = float(warn)
     crit = float(crit)
     okay, warning, critical, unknown, all_items = [], [], [], [], []
-    storage_domains = system.api.system_service().storage_domains_service().list()
+    inventory = get_inventory(system, kwargs)
+    storage_domains = inventory.storage_domains()
+    vm_counts = inventory.vm_counts_by_storage_domain()
+    perfdata = []
+    # usage level of each domain, to report the thresholds crossed since the previous run
+    levels = dict()
+    samples = []
 
     for storage_domain in storage_domains:
         if storage_domain.type == types.StorageDomainType.IMAGE:
@@ -131,268 +150,241 @@ def check_storage_domain_usage(system, warn=0.75, crit=0.9, **kwargs):
         used = storage_domain.used
         available = storage_domain.available
         status = used / (used + available)
-        sds = system._get_storage_domain_service(storage_domain.name)
-        vms = len(sds.vms_service().list())
+        vms = vm_counts.get(storage_domain.id, 0)
         if status < warn:
             okay.append((storage_domain.name, status))
+            level = "ok"
         elif warn <= status <= crit:
             warning.append((storage_domain.name, status))
+            level = "warning"
         elif status > crit:
             critical.append((storage_domain.name, status))
+            level = "critical"
         else:
             unknown.append((storage_domain.name, status))
+            level = "unknown"
+        levels[storage_domain.id] = (storage_domain.name, level)
+        samples.append((storage_domain.id, used, available))
         all_items.append((storage_domain.name, status, vms))
+        perfdata.append(
+            Perfdata(storage_domain.name + "_usage", round(status, 4), warn, crit, 0, 1)
+        )
+        perfdata.append(Perfdata(storage_domain.name + "_vms", vms, min=0))
+
+    usage_history = kwargs.get("usage_history")
+    if usage_history is not None:
+        usage_history.append(samples)
+        names = dict((sd_id, name) for sd_id, (name, _) in levels.items())
+        days_to_full = usage_history.days_to_full([sd_id for sd_id, _, _ in samples])
+        for sd_id, days in sorted(days_to_full.items(), key=lambda item: item[1]):
+            if days == float("inf"):
+                continue
+            name = names[sd_id]
+            perfdata.append(Perfdata(name + "_days_to_full", round(days, 1),
+                                     "{}:".format(full_warn), "{}:".format(full_crit), 0))
+            # domains already over a usage threshold are reported as such
+            if days <= float(full_crit) and levels[sd_id][1] != "critical":
+                critical.append((name, "full in {:.1f} days".format(days)))
+            elif days <= float(full_warn) and levels[sd_id][1] == "ok":
+                warning.append((name, "full in {:.1f} days".format(days)))
+
+    details = "Status of all storage_domain is: {}".format(all_items)
+    ok_items = all_items
+    state_store = kwargs.get("state_store")
+    if state_store is not None:
+        transitions = state_store.update("storage_domain_usage", levels)
+        perfdata.append(Perfdata("storage_domain_changes", len(transitions), min=0))
+        details = "Changes since last run: {}".format(format_transitions(transitions))
+        ok_items = "{} storage_domain(s). {}".format(len(okay), details)
 
     if critical:
         msg = ("Critical: the following storage_domain(s) definitely have an issue: {}\n "
-               "Status of all storage_domain is: {}".format(critical, all_items))
-        logger.error(msg)
-        print(msg)
-        sys.exit(2)
+               "{}".format(critical, details))
+        return CheckResult(CRITICAL, msg, perfdata)
     elif warning:
         msg = ("Warning: the following storage_domain(s) may have an issue: {}\n "
-               "Status of all storage_domain is: {}".format(warning, all_items))
-        logger.warning(msg)
-        print(msg)
-        sys.exit(1)
+               "{}".format(warning, details))
+        return CheckResult(WARNING, msg, perfdata)
     elif unknown:
         msg = ("Unknown: the following storage_domain(s) are in an unknown state: {}\n"
-               "Status of all storage_domain is: {}".format(unknown, all_items))
-        logger.info(msg)
-        print(msg)
-        sys.exit(3)
+               "{}".format(unknown, details))
+        return CheckResult(UNKNOWN, msg, perfdata)
     else:
-        msg = ("Ok: all storage_domain(s) are in the OK state: {}".format(all_items))
-        logger.info(msg)
-        print(msg)
-        sys.exit(0)
+        msg = ("Ok: all storage_domain(s) are in the OK state: {}".format(ok_items))
+        return CheckResult(OK, msg, perfdata)
 
 
 def check_locked_disks(system, warn=5, crit=10, **kwargs):
     """Check the count of locked disks."""
-    logger = kwargs["logger"]
     warn = int(warn)
     crit = int(crit)
-    # following function call is not available in wrapanapi yet, need to merge PR#373
-    locked_disks = len(system.list_disks(status='LOCKED'))
+    locked_disks = get_inventory(system, kwargs).locked_disk_count()
+    perfdata = [Perfdata("locked_disks", locked_disks, warn, crit, 0)]
     if locked_disks < warn:
         msg = ("Ok: locked_disks count is less than {}. locked_disks Count = {}"
                .format(warn, locked_disks))
-        logger.info(msg)
-        print(msg)
-        sys.exit(0)
+        return CheckResult(OK, msg, perfdata)
     elif warn <= locked_disks <= crit:
         msg = ("Warning: locked_disks count is greater than {}"
               " & less than {}. locked_disks Count = {}"
             .format(warn, crit, locked_disks))
-        logger.warning(msg)
-        print(msg)
-        sys.exit(1)
+        return CheckResult(WARNING, msg, perfdata)
     elif locked_disks > crit:
         msg = (
             "Critical: locked_disks count is greater than {}. locked_disks Count = {}".format(
                 crit, locked_disks
             )
         )
-        logger.error(msg)
-        print(msg)
-        sys.exit(2)
+        return CheckResult(CRITICAL, msg, perfdata)
     else:
         msg = ("Unknown: locked_disks count is unknown")
-        logger.info(msg)
-        print(msg)
-        sys.exit(3)
+        return CheckResult(UNKNOWN, msg, perfdata)
 
 
 def check_hosts_status(system, **kwargs):
     """ Check the status of all the hosts."""
-    logger = kwargs["logger"]
-    okay, warning, critical, unknown, all_items = [], [], [], [], []
-    hosts = system.api.system_service().hosts_service().list()
-
-    for host in hosts:
-        status = host.status
-        if status == types.HostStatus.UP:
-            okay.append((host.name, status))
-        elif (status == types.HostStatus.MAINTENANCE or status == types.HostStatus.UNASSIGNED or
-             status == types.HostStatus.REBOOT or status == types.HostStatus.CONNECTING or
-             status == types.HostStatus.INITIALIZING):
-            warning.append((host.name, status))
-        elif (status == types.HostStatus.ERROR or status == types.HostStatus.DOWN or
-             status == types.HostStatus.NON_OPERATIONAL or
-             status == types.HostStatus.NON_RESPONSIVE):
-            critical.append((host.name, status))
-        else:
-            unknown.append((host.name, status))
-        all_items.append((host.name, status))
-
-    if critical:
-        msg = ("Critical: the following host(s) definitely have an issue: {}\n "
-               "Status of all host is: {}".format(critical, all_items))
-        logger.error(msg)
-        print(msg)
-        sys.exit(2)
-    elif warning:
-        msg = ("Warning: the following host(s) may have an issue: {}\n "
-               "Status of all host is: {}".format(warning, all_items))
-        logger.warning(msg)
-        print(msg)
-        sys.exit(1)
-    elif unknown:
-        msg = ("Unknown: the following host(s) are in an unknown state: {}\n"
-               "Status of all host is: {}".format(unknown, all_items))
-        logger.info(msg)
-        print(msg)
-        sys.exit(3)
-    else:
-        msg = ("Ok: all host(s) are in the OK state: {}".format(okay))
-        logger.info(msg)
-        print(msg)
-        sys.exit(0)
+    return _status_check(system, kwargs, "host", "host", lambda inventory: inventory.hosts())
 
 
 def check_datacenters_status(system, **kwargs):
     """ Check the status of all the datacenters."""
-    logger = kwargs["logger"]
-    okay, warning, critical, unknown, all_items = [], [], [], [], []
-    datacenters = system.api.system_service().data_centers_service().list()
-
-    for datacenter in datacenters:
-        status = datacenter.status
-        if status == types.DataCenterStatus.UP:
-            okay.append((datacenter.name, status))
-        elif (status == types.DataCenterStatus.MAINTENANCE or
-        status == types.DataCenterStatus.UNINITIALIZED):
-            warning.append((datacenter.name, status))
-        elif (status == types.DataCenterStatus.PROBLEMATIC or
-        status == types.DataCenterStatus.NOT_OPERATIONAL):
-            critical.append((datacenter.name, status))
-        else:
-            unknown.append((datacenter.name, status))
-        all_items.append((datacenter.name, status))
-
-    if critical:
-        msg = ("Critical: the following datacenter(s) definitely have an issue: {}\n "
-               "Status of all datacenter is: {}".format(critical, all_items))
-        logger.error(msg)
-        print(msg)
-        sys.exit(2)
-    elif warning:
-        msg = ("Warning: the following datacenter(s) may have an issue: {}\n "
-               "Status of all datacenter is: {}".format(warning, all_items))
-        logger.warning(msg)
-        print(msg)
-        sys.exit(1)
-    elif unknown:
-        msg = ("Unknown: the following datacenter(s) are in an unknown state: {}\n"
-               "Status of all datacenter is: {}".format(unknown, all_items))
-        logger.info(msg)
-        print(msg)
-        sys.exit(3)
-    else:
-        msg = ("Ok: all datacenter(s) are in the OK state: {}".format(okay))
-        logger.info(msg)
-        print(msg)
-        sys.exit(0)
+    return _status_check(system, kwargs, "datacenter", "datacenter",
+                         lambda inventory: inventory.data_centers())
 
 
 def check_storage_domain_attached_status(system, **kwargs):
     """ Check the usage of all the storage domain attached to the datacenters. """
-    logger = kwargs["logger"]
     okay, critical, all_items = [], [], []
-    storage_domains_service = system.api.system_service().storage_domains_service()
-    all_sd = storage_domains_service.list()
-    data_centers_service = system.api.system_service().data_centers_service()
-    all_dc = data_centers_service.list()
-
-    for dc in all_dc:
-        dc_service = data_centers_service.data_center_service(dc.id)
-        attached_sds_service = dc_service.storage_domains_service()
-        for sd in all_sd:
+    inventory = get_inventory(system, kwargs)
+    all_sd = inventory.storage_domains()
+    # one listing per datacenter, joined locally with the storage domains by id
+    attached = inventory.attached_storage_domains()
+    attached_sd_ids = set()
+
+    for attached_sds in attached.values():
+        for sd in attached_sds:
             if sd.type == types.StorageDomainType.IMAGE:
                 # Skipping sd as it is of type IMAGE
                 continue
-            attached_sds_service_sd_id = attached_sds_service.storage_domain_service(sd.id)
-            status = attached_sds_service_sd_id.get().status
-            if status == types.StorageDomainStatus.ACTIVE:
-                okay.append((sd.name, status.value))
+            attached_sd_ids.add(sd.id)
+            status = sd.status.value if sd.status is not None else None
+            if sd.status == types.StorageDomainStatus.ACTIVE:
+                okay.append((sd.name, status))
             else:
-                critical.append((sd.name, status.value))
-            all_items.append((sd.name, status.value))
+                critical.append((sd.name, status))
+            all_items.append((sd.name, status))
+
+    for sd in all_sd:
+        if sd.type == types.StorageDomainType.IMAGE or sd.id in attached_sd_ids:
+            continue
+        critical.append((sd.name, "unattached"))
+        all_items.append((sd.name, "unattached"))
+
+    perfdata = [
+        Perfdata("storage_domains_active", len(okay), min=0),
+        Perfdata("storage_domains_failed", len(critical), 0, 0, 0),
+    ]
 
     if critical:
         msg = ("Critical: the following Storage Domain(s) definitely have an issue: {}\n "
                "Status of all Storage Domain(s) are: {}".format(critical, all_items))
-        logger.error(msg)
-        print(msg)
-        sys.exit(2)
+        return CheckResult(CRITICAL, msg, perfdata)
     else:
         msg = ("Ok: all Storage Domain(s) are Attached to Data Center(s): {}".format(okay))
-        logger.info(msg)
-        print(msg)
-        sys.exit(0)
+        return CheckResult(OK, msg, perfdata)
 
 
-def check_vms_distributed_hosts(system, warn=5, crit=10, **kwargs):
-    """VMs are evenly distributed across the hosts"""
-    logger = kwargs["logger"]
-    warn = int(warn)
-    crit = int(crit)
-    # get all the hosts
-    hosts = system.api.system_service().hosts_service().list()
+# migrations listed by vms_distributed_hosts, the others are only counted
+MIGRATIONS_SHOWN = 10
 
-    # get number of VMs on each host
-    hosts_vms = dict()
-    for host in hosts:
-        hosts_vms[host.name] = host.summary.total
 
-    # check the difference between the lowest and the highest number
-    max_hosts_vms = max(hosts_vms.values())
-    min_hosts_vms = min(hosts_vms.values())
+def check_vms_distributed_hosts(system, warn=5, crit=10, balance_window=None, **kwargs):
+    """
+    VMs are evenly distributed across the hosts of each cluster, in proportion to their CPU
+    threads and memory. With a balance_history, a cluster only alerts once it has been
+    unbalanced for balance_window seconds.
+    """
+    from vm_balance import expected_vms
+    from vm_balance import host_arrays
+    from vm_balance import rebalance
+    from vm_balance import spread
 
-    vms_host_diff = max_hosts_vms - min_hosts_vms
+    warn = int(warn)
+    crit = int(crit)
+    inventory = get_inventory(system, kwargs)
+    # hosts down or in maintenance run no VM, whatever the balance of their cluster
+    hosts = [host for host in inventory.hosts() if host.status == types.HostStatus.UP]
+    if not hosts:
+        return CheckResult(UNKNOWN, "Unknown: no host is up to run VMs", [])
+    cluster_names = dict((cluster.id, cluster.name) for cluster in inventory.clusters())
+
+    cluster_ids, cluster, vms, cpus, memory = host_arrays(hosts)
+    expected = expected_vms(cluster, vms, cpus, memory)
+    spreads = dict(zip(cluster_ids, spread(cluster, vms - expected).tolist()))
+    levels = spreads
+    balance_history = kwargs.get("balance_history")
+    windowed = balance_history is not None and bool(balance_window)
+    if windowed:
+        levels = dict(
+            (cluster_id, 0 if level is None else level)
+            for cluster_id, level in balance_history.record(spreads, float(balance_window)).items()
+        )
 
-    # determine ok, warning, critical, unknown state
-    if vms_host_diff < warn:
-        msg = ("Ok: VMs difference on hosts is less than {}. VMs difference = {}."
-              "The distribution is {}".format(warn, vms_host_diff, hosts_vms))
-        logger.info(msg)
-        print(msg)
-        sys.exit(0)
-    elif warn <= vms_host_diff <= crit:
-        msg = (
-            "Warning: VMs difference on hosts is more than {} & less than {}. VMs difference = {}."
-            "The distribution is {}".format(warn, crit, vms_host_diff, hosts_vms))
-        logger.warning(msg)
-        print(msg)
-        sys.exit(1)
-    elif vms_host_diff > crit:
-        msg = ("Critical: VMs difference on hosts is more than {}. VMs difference = {}"
-              "The distribution is {}".format(crit, vms_host_diff, hosts_vms))
-        logger.error(msg)
-        print(msg)
-        sys.exit(2)
-    else:
-        msg = ("Unknown: VMs on hosts are unknown")
-        logger.info(msg)
-        print(msg)
-        sys.exit(3)
+    names = [cluster_names.get(cluster_id, cluster_id) for cluster_id in cluster_ids]
+    distribution = dict((names[index], round(spreads[cluster_id], 1))
+                        for index, cluster_id in enumerate(cluster_ids))
+    perfdata = [Perfdata("vms_difference", round(max(spreads.values()), 1), warn, crit, 0)]
+    perfdata.extend(
+        Perfdata(names[index] + "_vms_spread", round(spreads[cluster_id], 1), warn, crit, 0)
+        for index, cluster_id in enumerate(cluster_ids)
+    )
+    perfdata.extend(Perfdata(host.name + "_vms", int(total), min=0)
+                    for host, total in zip(hosts, vms))
+
+    unbalanced = [index for index, cluster_id in enumerate(cluster_ids)
+                  if levels[cluster_id] >= warn]
+    if not unbalanced and windowed:
+        msg = ("Ok: no cluster had a VMs difference on hosts of {} or more for the last {}s. "
+               "The distribution is {}".format(warn, balance_window, distribution))
+        return CheckResult(OK, msg, perfdata)
+    if not unbalanced:
+        msg = ("Ok: VMs difference on hosts is less than {} in every cluster. "
+               "The distribution is {}".format(warn, distribution))
+        return CheckResult(OK, msg, perfdata)
+
+    moves = rebalance(cluster, vms, expected, unbalanced)
+    perfdata.append(Perfdata("vms_to_migrate", sum(count for count, _, _ in moves), min=0))
+    plan = ", ".join("{} -> {}: {} VMs".format(hosts[src].name, hosts[dst].name, int(count))
+                     for count, src, dst in moves[:MIGRATIONS_SHOWN])
+    if len(moves) > MIGRATIONS_SHOWN:
+        plan += " and {} more".format(len(moves) - MIGRATIONS_SHOWN)
+    clusters = [names[index] for index in unbalanced]
+
+    if any(levels[cluster_ids[index]] > crit for index in unbalanced):
+        msg = ("Critical: VMs difference on hosts is more than {} in cluster(s) {}. "
+               "The distribution is {}\n Suggested migrations: {}".format(
+                   crit, clusters, distribution, plan))
+        return CheckResult(CRITICAL, msg, perfdata)
+    msg = ("Warning: VMs difference on hosts is more than {} in cluster(s) {}. "
+           "The distribution is {}\n Suggested migrations: {}".format(
+               warn, clusters, distribution, plan))
+    return CheckResult(WARNING, msg, perfdata)
 
 
 def check_hosted_engine_status(system, **kwargs):
     """ Check the status of all the host's Hosted Engine Status."""
-    logger = kwargs["logger"]
     okay, critical, warning, all_items = [], [], [], []
+    perfdata = []
     # Get all the hosts with details.
-    hosts = system.api.system_service().hosts_service().list(all_content=True)
+    hosts = get_inventory(system, kwargs).hosts(all_content=True)
 
     for host in hosts:
         host_info = {
-            "Configured": host.hosted_engine.configured,
-            "Active": host.hosted_engine.active,
-            "local_maintenance": host.hosted_engine.local_maintenance,
-            "global_maintenance": host.hosted_engine.global_maintenance,
-            "Score": host.hosted_engine.score,
+            "Configured": host.hosted_engine_configured,
+            "Active": host.hosted_engine_active,
+            "local_maintenance": host.hosted_engine_local_maintenance,
+            "global_maintenance": host.hosted_engine_global_maintenance,
+            "Score": host.hosted_engine_score,
         }
         engine_value = all((host_info["Active"], host_info["Configured"]))
         maintenance_value = any(
@@ -406,64 +398,144 @@ def check_hosted_engine_status(system, **kwargs):
         if host_info["Score"] < 3400:
             warning.append((host.name, host_info["Score"]))
         all_items.append((host.name, host_info))
+        perfdata.append(
+            Perfdata(host.name + "_score", host_info["Score"], "3400:", min=0, max=3400)
+        )
 
     if critical:
         msg = ("Critical: The following host's hosted-engine status has an issue: {state}\n "
             "Status of all host is: {all_items}".format(state=critical, all_items=all_items))
-        logger.error(msg)
-        print(msg)
-        sys.exit(2)
+        return CheckResult(CRITICAL, msg, perfdata)
     elif warning:
         msg = ("Warning: The following host's hosted-engine score reported below 3400: {}".format(
             warning
         ))
-        logger.warning(msg)
-        print(msg)
-        sys.exit(1)
+        return CheckResult(WARNING, msg, perfdata)
     else:
         msg = ("Ok: all host(s) hosted-engine status is in the OK state: {}".format(okay))
-        logger.info(msg)
-        print(msg)
-        sys.exit(0)
+        return CheckResult(OK, msg, perfdata)
+
+
+def _host_services_status(ssh_pool, address_cache, host_id, host_service, services, password,
+                          host_timeout):
+    """Status of each service on one host, giving up once host_timeout seconds are spent."""
+    deadline = Deadline(host_timeout)
+    ssh = ssh_pool.get(
+        host_id,
+        lambda: ssh_client(host_service, username="root", password=password,
+                           timeout=min(60, host_timeout), address_cache=address_cache,
+                           host_id=host_id, deadline=deadline)
+    )
+    remaining = deadline.remaining()
+    if remaining <= 0:
+        raise socket.timeout("host did not answer within {}s".format(host_timeout))
+    try:
+        # one remote command for all the services of the host
+        properties = services_properties(ssh, list(services.keys()), timeout=remaining)
+    except Exception:
+        ssh_pool.discard(host_id)
+        raise
+    return {
+        service_name: is_in_status(properties.get(service_name, {}), status)
+        for service_name, status in services.items()
+    }
 
 
-def check_services_status(system, **kwargs):
-    """Check to see if service are in the desired state"""
-    logger = kwargs["logger"]
-    hosts = system.api.system_service().hosts_service()
+def services_states(system, inventory, services, workers=10, host_timeout=120, ssh_pool=None,
+                    address_cache=None, deadline=None):
+    """
+    {host name: {service name: whether it is in its desired state}} of the hosts that could
+    be checked over SSH, and {host name: reason} of the ones that could not, by the Deadline
+    when one is given.
+    """
+    for status in services.values():
+        # raises for a status that could never match, before connecting to any host
+        expected_properties(status)
+    hosts = inventory.system_service.hosts_service()
     hosts_agents = dict()
-    hosts_status = dict()
-
-    services = kwargs["services"]
+    unreachable = dict()
+    password = system.api._password
+    workers = int(workers)
+    host_timeout = float(host_timeout)
+    # connections are kept by the caller's pool if any, closed at the end otherwise;
+    # address_cache has the address each host answered SSH on last time
+    own_ssh_pool = ssh_pool is None
+    if own_ssh_pool:
+        ssh_pool = SSHPool()
+
+    deadline = deadline or Deadline()
+    host_list = inventory.hosts()
+    # a host can wait for a free worker before its own deadline starts
+    rounds = -(-len(host_list) // max(1, workers))
+    if deadline.remaining() is not None:
+        # each round of hosts gets its share of the budget, a slow host can not take it all
+        host_timeout = min(host_timeout, deadline.remaining() / max(1, rounds))
+
+    # hosts are checked concurrently, each one within its own deadline
+    pool = ThreadPoolExecutor(max_workers=max(1, workers))
+    # the calls to the manager of the workers are counted in the stats of the check
+    host_services_status = inventory.api_stats.bind(_host_services_status)
+    futures = {
+        pool.submit(host_services_status, ssh_pool, address_cache, host.id,
+                    hosts.host_service(host.id), services, password, host_timeout): host.name
+        for host in host_list
+    }
+    done, not_done = wait(futures, timeout=deadline.timeout(rounds * host_timeout + 1))
+    for future in done:
+        host_name = futures[future]
+        try:
+            hosts_agents[host_name] = future.result()
+        except Exception as e:
+            unreachable[host_name] = "{}: {}".format(type(e).__name__, e)
+    for future in not_done:
+        # hosts not started yet are dropped, the running ones end by their own deadline
+        future.cancel()
+        if deadline.expired():
+            unreachable[futures[future]] = "not checked within the time budget of --timeout"
+        else:
+            unreachable[futures[future]] = "timed out after {}s".format(host_timeout)
+    # do not wait for the stuck hosts, their sockets time out on their own
+    pool.shutdown(wait=False)
+    if own_ssh_pool:
+        ssh_pool.close()
+    return hosts_agents, unreachable
 
-    for host in hosts.list():
-        host_service = hosts.host_service(host.id)
-        ssh = ssh_client(host_service, username="root", password=system.api._password)
-        with ssh:
-            for service_name, status in services.items():
-                service_status = is_service_in_status(ssh, service_name, status)
-                try:
-                    hosts_agents[host.name].update({service_name: service_status})
-                except KeyError:
-                    hosts_agents[host.name] = {service_name: service_status}
 
-        hosts_status[host.name] = all(hosts_agents[host.name].values())
+def check_services_status(system, workers=10, host_timeout=120, **kwargs):
+    """Check to see if service are in the desired state"""
+    services = kwargs["services"]
+    hosts_agents, unreachable = services_states(
+        system, get_inventory(system, kwargs), services, workers=workers,
+        host_timeout=host_timeout, ssh_pool=kwargs.get("ssh_pool"),
+        address_cache=kwargs.get("address_cache"), deadline=kwargs.get("deadline")
+    )
+    hosts_status = dict(
+        (host_name, all(agents.values())) for host_name, agents in hosts_agents.items()
+    )
 
     overall_status = all(hosts_status.values())
+    failed = len([status for status in hosts_status.values() if not status])
+    perfdata = [
+        Perfdata("hosts_ok", len(hosts_status) - failed, min=0),
+        Perfdata("hosts_failed", failed, 0, 0, 0),
+        Perfdata("hosts_unreachable", len(unreachable), min=0),
+    ]
 
     # TODO: add the exact desired state in message instead of True/False
-    if overall_status:  # all true, everything is running
-        msg = ("Ok: all services {} are in the desired state on all hosts".format(services.keys()))
-        logger.info(msg)
-        print(msg)
-        sys.exit(0)
-    else:
-        trouble_hosts = [host for host, status in hosts_status.iteritems() if not status]
+    if not overall_status:
+        trouble_hosts = [host for host, status in hosts_status.items() if not status]
         msg = ("Critical: These hosts don't have all agents in the desired state: {}."
                "Overall status is {}".format(trouble_hosts, hosts_agents))
-        logger.info(msg)
-        print(msg)
-        sys.exit(2)
+        if unreachable:
+            msg += ". Hosts that could not be checked: {}".format(unreachable)
+        return CheckResult(CRITICAL, msg, perfdata)
+    elif unreachable:
+        msg = ("Unknown: services could not be checked on these hosts: {}."
+               "Overall status is {}".format(unreachable, hosts_agents))
+        return CheckResult(UNKNOWN, msg, perfdata)
+    else:  # all true, everything is running
+        msg = ("Ok: all services {} are in the desired state on all hosts".format(services.keys()))
+        return CheckResult(OK, msg, perfdata)
 
 
 CHECKS = {
@@ -479,3 +551,23 @@ CHECKS = {
     "hosted_engine_status": check_hosted_engine_status,
     "services_status": check_services_status,
     }
+
+# position of the id of the object concerned by an event in Inventory.events_since, per kind
+EVENT_LINKS = {"host": 1, "storage_domain": 2, "datacenter": 3}
+# checks that only list their objects when the events show a change, with a state store
+EVENT_TRACKED_CHECKS = ("hosts_status", "storage_domain_status", "datacenter_status")
+
+# inventory collections read by each check, so a batch run can fetch them up front
+CHECK_COLLECTIONS = {
+    "vm_count": ("summary",),
+    "template_count": ("template_count",),
+    "locked_disks_count": ("locked_disk_count",),
+    "storage_domain_status": ("storage_domains",),
+    "storage_domain_usage": ("storage_domains", "vm_counts_by_storage_domain"),
+    "hosts_status": ("hosts",),
+    "datacenter_status": ("data_centers",),
+    "storage_domain_attached": ("storage_domains", "data_centers", "attached_storage_domains"),
+    "vms_distributed_hosts": ("hosts", "clusters"),
+    "hosted_engine_status": ("hosts_all_content",),
+    "services_status": ("hosts",),
+    }
@@ -0,0 +1,90 @@
+# coding: utf-8
+"""
+Asyncio engine running independent blocking calls (API listings of one or several RHV
+Managers) concurrently, so the time of a run is the one of its slowest call rather than the
+sum of all of them.
+"""
+import asyncio
+import threading
+
+
+def _resolve(future, result, exception):
+    # the caller may have stopped waiting, e.g. on a timeout
+    if future.done():
+        return
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
+
+
+class Engine(object):
+    """
+    Event loop handing each blocking call to its own daemon thread, at most ``max_workers`` at
+    a time. A call that times out is reported as such and its thread is left to finish in the
+    background: it never keeps the process from exiting, e.g. when an RHV Manager is down.
+    """
+
+    def __init__(self, max_workers=16):
+        self.max_workers = max_workers
+        self._loop = asyncio.new_event_loop()
+
+    def _thread_future(self, func, *args, **kwargs):
+        future = self._loop.create_future()
+
+        def target():
+            result, exception = None, None
+            try:
+                result = func(*args, **kwargs)
+            except BaseException as e:
+                exception = e
+            try:
+                self._loop.call_soon_threadsafe(_resolve, future, result, exception)
+            except RuntimeError:
+                # the loop was closed meanwhile, nobody waits for this result anymore
+                pass
+
+        thread = threading.Thread(target=target)
+        thread.daemon = True
+        thread.start()
+        return future
+
+    async def call(self, func, *args, timeout=None, semaphore=None, **kwargs):
+        if semaphore is not None:
+            async with semaphore:
+                return await self.call(func, *args, timeout=timeout, **kwargs)
+        future = self._thread_future(func, *args, **kwargs)
+        if timeout is None:
+            return await future
+        return await asyncio.wait_for(future, timeout)
+
+    def run(self, coroutine):
+        return self._loop.run_until_complete(coroutine)
+
+    async def _gather(self, calls, timeout):
+        semaphore = asyncio.Semaphore(self.max_workers)
+        return await asyncio.gather(
+            *[self.call(call, timeout=timeout, semaphore=semaphore) for call in calls],
+            return_exceptions=True
+        )
+
+    def gather(self, calls, timeout=None):
+        """
+        Run the callables concurrently and return their results in the same order, with the
+        exception raised by a call (asyncio.TimeoutError if it timed out) in place of its result.
+        """
+        return self.run(self._gather(calls, timeout))
+
+    def gather_dict(self, calls, timeout=None):
+        """Same as gather for a dict of callables, e.g. one per RHV Manager."""
+        keys = list(calls.keys())
+        return dict(zip(keys, self.gather([calls[key] for key in keys], timeout=timeout)))
+
+    def close(self):
+        self._loop.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
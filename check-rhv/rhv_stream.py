@@ -0,0 +1,281 @@
+# coding: utf-8
+"""
+Streaming reader of the RHV API collections. The XML response is parsed while it is received
+and only the declared fields of each object are kept, in small records with __slots__, instead
+of building the full ovirtsdk4 object graph of the whole collection. Requests go through a
+pool of keep-alive connections.
+"""
+import ssl
+import threading
+import time
+import zlib
+
+from http.client import HTTPConnection
+from http.client import HTTPException
+from http.client import HTTPSConnection
+from urllib.parse import urlencode
+from urllib.parse import urlsplit
+from xml.etree.ElementTree import XMLPullParser
+
+from ovirtsdk4 import Error
+
+from api_stats import active_stats
+
+CHUNK_SIZE = 64 * 1024
+
+
+class Field(object):
+    """
+    One value to keep from each object of a collection: ``path`` is the element path below
+    the object, e.g. 'summary/total', with '@name' for an attribute, e.g. '@id' or
+    'cluster/@id'. ``convert`` turns the text into a value, unconvertible text is kept as is.
+    With ``multiple`` the values of all the elements at path are kept, in a list.
+    """
+    __slots__ = ("name", "path", "convert", "multiple")
+
+    def __init__(self, name, path=None, convert=None, multiple=False):
+        self.name = name
+        self.path = tuple((path or name).split("/"))
+        self.convert = convert
+        self.multiple = multiple
+
+    def value(self, text):
+        if self.multiple:
+            return [self._convert(item) for item in text]
+        return self._convert(text)
+
+    def _convert(self, text):
+        if text is None or self.convert is None:
+            return text
+        try:
+            return self.convert(text)
+        except ValueError:
+            return text
+
+
+def to_bool(text):
+    return text.strip().lower() == "true"
+
+
+_RECORD_TYPES = dict()
+
+
+def record_type(names):
+    """Class with one slot per field name, shared by all the records with these fields."""
+    names = tuple(names)
+    cls = _RECORD_TYPES.get(names)
+    if cls is None:
+        def __init__(self, *values):
+            for name, value in zip(names, values):
+                setattr(self, name, value)
+
+        def __reduce__(self):
+            return make_record, (names, tuple(getattr(self, name) for name in names))
+
+        def __repr__(self):
+            return "Record({})".format(
+                ", ".join("{}={!r}".format(name, getattr(self, name)) for name in names)
+            )
+
+        cls = type("Record", (object,), {
+            "__slots__": names,
+            "__init__": __init__,
+            "__reduce__": __reduce__,
+            "__repr__": __repr__,
+        })
+        _RECORD_TYPES[names] = cls
+    return cls
+
+
+def make_record(names, values):
+    return record_type(names)(*values)
+
+
+def parse_records(chunks, fields):
+    """
+    Yield one record per object of the collection whose XML document arrives in chunks.
+    Each object is dropped from the parse tree as soon as its record is built.
+    """
+    cls = record_type(field.name for field in fields)
+    by_path = {field.path: index for index, field in enumerate(fields)}
+    multiple = [field.multiple for field in fields]
+
+    def keep(values, index, value):
+        if multiple[index]:
+            values[index].append(value)
+        else:
+            values[index] = value
+    parser = XMLPullParser(events=("start", "end"))
+    root = None
+    # tags from the object down to the current element
+    path = []
+    values = None
+
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event, elem in parser.read_events():
+            if event == "start":
+                if root is None:
+                    root = elem
+                    continue
+                if values is None:
+                    values = [[] if many else None for many in multiple]
+                else:
+                    path.append(elem.tag)
+                for name, value in elem.attrib.items():
+                    index = by_path.get(tuple(path) + ("@" + name,))
+                    if index is not None:
+                        keep(values, index, value)
+            elif elem is root:
+                continue
+            elif path:
+                index = by_path.get(tuple(path))
+                if index is not None:
+                    keep(values, index, elem.text)
+                path.pop()
+            else:
+                yield cls(*(field.value(value) for field, value in zip(fields, values)))
+                values = None
+                root.clear()
+    parser.close()
+
+
+class ConnectionPool(object):
+    """
+    Keep-alive HTTP(S) connections to the API servers, shared by all the streamed listings so
+    concurrent and successive requests do not each pay a TCP and TLS handshake.
+    """
+
+    def __init__(self, max_idle=8):
+        self.max_idle = max_idle
+        self._idle = dict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """An idle connection for key, None if there is none."""
+        with self._lock:
+            idle = self._idle.get(key)
+            return idle.pop() if idle else None
+
+    def put(self, key, connection):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(connection)
+                return
+        connection.close()
+
+
+POOL = ConnectionPool()
+_AUTH_LOCK = threading.Lock()
+
+
+def authenticate(connection):
+    """
+    The SSO token of the ovirtsdk4 connection. The SDK does not synchronise getting one, so
+    the threads listing concurrently wait for the first one to log in instead of each doing so.
+    """
+    with _AUTH_LOCK:
+        lock = getattr(connection, "_auth_lock", None)
+        if lock is None:
+            lock = connection._auth_lock = threading.Lock()
+    with lock:
+        return connection.authenticate()
+
+
+def _new_connection(scheme, netloc, connection):
+    timeout = connection._timeout or None
+    if scheme == "http":
+        return HTTPConnection(netloc, timeout=timeout)
+    if connection._insecure:
+        context = ssl._create_unverified_context()
+    else:
+        context = ssl.create_default_context(cafile=connection._ca_file)
+    return HTTPSConnection(netloc, timeout=timeout, context=context)
+
+
+def _chunks(response, gzipped, received):
+    """Decompressed chunks of the body, received[0] counts the bytes read from the server."""
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if gzipped else None
+    while True:
+        chunk = response.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        received[0] += len(chunk)
+        yield decompressor.decompress(chunk) if decompressor else chunk
+    if decompressor:
+        yield decompressor.flush()
+
+
+def _get(connection, path, headers):
+    """
+    Send the GET over a pooled connection, retrying once over a new one if the pooled one was
+    closed by the server meanwhile. Returns the pool key, the HTTP connection and the response.
+    """
+    url = urlsplit(connection.url + path)
+    key = (url.scheme, url.netloc, connection._insecure, connection._ca_file)
+    target = url.path + ("?" + url.query if url.query else "")
+    http = POOL.get(key)
+    if http is not None:
+        try:
+            http.request("GET", target, headers=headers)
+            return key, http, http.getresponse()
+        except (HTTPException, OSError):
+            http.close()
+    http = _new_connection(url.scheme, url.netloc, connection)
+    try:
+        http.request("GET", target, headers=headers)
+        return key, http, http.getresponse()
+    except Exception:
+        http.close()
+        raise
+
+
+def stream_records(connection, path, fields, all_content=False, **query):
+    """
+    Yield the records of the collection at path (e.g. '/hosts') of the API the ovirtsdk4
+    connection points at, reusing its SSO token and TLS settings. The request is counted in
+    the ApiStats of the calling thread (see api_stats.active_stats), if any.
+    """
+    stats = active_stats(connection)
+    start = time.time()
+    received = [0]
+    if all_content:
+        query["all_content"] = "true"
+    if query:
+        path = "{}?{}".format(path, urlencode(sorted(query.items())))
+
+    for attempt in range(2):
+        key, http, response = _get(connection, path, {
+            "Accept": "application/xml",
+            "Accept-Encoding": "gzip",
+            "Authorization": "Bearer {}".format(authenticate(connection)),
+            "Version": "4",
+            # engines older than 4.1 only read it from the headers
+            "All-Content": "true" if all_content else "false",
+        })
+        if response.status < 400:
+            break
+        response.read()
+        POOL.put(key, http)
+        if response.status != 401 or attempt:
+            raise Error(
+                "Listing {} failed: HTTP response code is {}. HTTP response message is "
+                "\"{}\".".format(path, response.status, response.reason),
+                code=response.status
+            )
+        # the SSO token expired, get a new one like the SDK does
+        connection._sso_token = None
+
+    try:
+        gzipped = response.getheader("Content-Encoding") == "gzip"
+        for record in parse_records(_chunks(response, gzipped, received), fields):
+            yield record
+    except BaseException:
+        # the rest of the response was not read, the connection can not be reused
+        http.close()
+        raise
+    finally:
+        if stats is not None:
+            stats.record(path, time.time() - start, received[0])
+    POOL.put(key, http)
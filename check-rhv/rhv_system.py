@@ -0,0 +1,36 @@
+# coding: utf-8
+"""
+The RHV Manager the checks run against: the ovirtsdk4 connection the checks use, without
+wrapanapi, whose import loads the SDKs of all the providers it supports.
+"""
+
+
+class RHVSystem(object):
+    """
+    Drop-in for wrapanapi's RHEVMSystem as far as the checks are concerned: ``api`` is the
+    ovirtsdk4 Connection, created on first use with the same settings as wrapanapi. ``scheme``
+    can be set to 'http' for the fake API of the benchmarks.
+    """
+
+    def __init__(self, hostname, username, password, version=4.3, port=None, scheme="https"):
+        url_component = "api" if float(version) < 4.0 else "ovirt-engine/api"
+        netloc = hostname if port is None else "{}:{}".format(hostname, port)
+        self._api = None
+        self._api_kwargs = {
+            "url": "{}://{}/{}".format(scheme, netloc, url_component),
+            "username": username,
+            "password": password,
+            "insecure": True,
+        }
+
+    @property
+    def api(self):
+        if self._api is None:
+            from ovirtsdk4 import Connection
+            self._api = Connection(**self._api_kwargs)
+        return self._api
+
+    def disconnect(self):
+        if self._api is not None:
+            self._api.close()
+            self._api = None
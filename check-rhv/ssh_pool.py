@@ -0,0 +1,104 @@
+# coding: utf-8
+"""
+Pool of SSH connections to the hosts, so check_services_status reuses the authenticated
+transports within a batch run and across the runs of check_rhv_daemon.
+"""
+import threading
+import time
+
+
+class SSHPool(object):
+    """
+    SSH clients keyed by host. Transports are kept alive with keepalive packets, checked
+    before being handed out again and closed once unused for ``idle_timeout`` seconds.
+    """
+
+    def __init__(self, idle_timeout=300, keepalive=30):
+        self.idle_timeout = idle_timeout
+        self.keepalive = keepalive
+        self.hits = 0
+        self.misses = 0
+        self.reconnects = 0
+        self.evictions = 0
+        self._clients = dict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _is_alive(client):
+        transport = client.get_transport()
+        if transport is None or not transport.is_active():
+            return False
+        try:
+            # cheap round trip through the transport, fails if the peer went away
+            transport.send_ignore()
+        except Exception:
+            return False
+        return True
+
+    @staticmethod
+    def _close(client):
+        try:
+            client.close()
+        except Exception:
+            pass
+
+    def get(self, key, connect):
+        """The pooled client of key, calling connect() to create it when none is alive."""
+        self.evict_idle()
+        with self._lock:
+            entry = self._clients.pop(key, None)
+        if entry is not None:
+            client = entry[0]
+            if self._is_alive(client):
+                with self._lock:
+                    self.hits += 1
+                    self._clients[key] = [client, time.time()]
+                return client
+            self._close(client)
+            with self._lock:
+                self.reconnects += 1
+        else:
+            with self._lock:
+                self.misses += 1
+
+        client = connect()
+        transport = client.get_transport()
+        if transport is not None and self.keepalive:
+            transport.set_keepalive(self.keepalive)
+        with self._lock:
+            self._clients[key] = [client, time.time()]
+        return client
+
+    def discard(self, key):
+        """Drop the client of key, e.g. after an error while using it."""
+        with self._lock:
+            entry = self._clients.pop(key, None)
+        if entry is not None:
+            self._close(entry[0])
+
+    def evict_idle(self):
+        now = time.time()
+        with self._lock:
+            idle = [key for key, (_, last_used) in self._clients.items()
+                    if now - last_used > self.idle_timeout]
+            entries = [self._clients.pop(key) for key in idle]
+            self.evictions += len(entries)
+        for client, _ in entries:
+            self._close(client)
+
+    def close(self):
+        with self._lock:
+            entries = list(self._clients.values())
+            self._clients.clear()
+        for client, _ in entries:
+            self._close(client)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "connections": len(self._clients),
+                "hits": self.hits,
+                "misses": self.misses,
+                "reconnects": self.reconnects,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,101 @@
+# coding: utf-8
+"""
+Last known status of the hosts, datacenters and storage domains, kept between runs so the
+checks can report what changed since the previous one, and skip listing the objects when the
+events of the engine show none of them changed.
+"""
+import fcntl
+import json
+import threading
+import time
+
+from disk_cache import atomic_write
+
+
+class StateStore(object):
+    """
+    Per kind of object (e.g. 'host'): the [name, status] of each object id, the id of the
+    last event of the engine seen when they were recorded and when they were last listed.
+    Kept in a JSON file, or in memory only when no path is given. ``full_refresh`` is the
+    number of seconds after which the objects are listed again whatever the events say.
+    """
+
+    def __init__(self, path=None, full_refresh=900):
+        self.path = path
+        self.full_refresh = full_refresh
+        self._kinds = dict()
+        self._changed = set()
+        self._lock = threading.Lock()
+        if path is not None:
+            self._kinds = self._read()
+
+    def _read(self):
+        try:
+            with open(self.path, "r") as state_file:
+                return json.load(state_file)
+        except (IOError, OSError, ValueError):
+            return dict()
+
+    def objects(self, kind):
+        """{id: [name, status]} of kind, None if it was never recorded."""
+        with self._lock:
+            entry = self._kinds.get(kind)
+            return None if entry is None else dict(entry["objects"])
+
+    def event_id(self, kind):
+        """Id of the last event seen when kind was recorded, None if there is none."""
+        with self._lock:
+            return self._kinds.get(kind, {}).get("event_id")
+
+    def needs_listing(self, kind):
+        """Whether the objects of kind must be listed, events aside."""
+        with self._lock:
+            entry = self._kinds.get(kind)
+            return entry is None or time.time() - entry["listed"] >= self.full_refresh
+
+    def update(self, kind, objects, event_id=None, listed=True):
+        """
+        Record {id: (name, status)} for kind and return the transitions since the previous
+        record as (name, old status, new status), None standing for a new or removed object.
+        Nothing is a transition on the first record of a kind.
+        """
+        objects = {object_id: list(item) for object_id, item in objects.items()}
+        with self._lock:
+            entry = self._kinds.get(kind)
+            transitions = []
+            if entry is not None:
+                previous = entry["objects"]
+                for object_id, (name, status) in objects.items():
+                    old = previous.get(object_id)
+                    if old is None or old[1] != status:
+                        transitions.append((name, None if old is None else old[1], status))
+                for object_id, (name, status) in previous.items():
+                    if object_id not in objects:
+                        transitions.append((name, status, None))
+            self._kinds[kind] = {
+                "objects": objects,
+                "event_id": event_id,
+                "listed": time.time() if listed or entry is None else entry["listed"],
+            }
+            self._changed.add(kind)
+        return transitions
+
+    def save(self):
+        """
+        Write the kinds recorded by this process, merged with the file under a lock, so the
+        processes checking different kinds of objects do not overwrite each other.
+        """
+        if self.path is None:
+            return
+        with self._lock:
+            if not self._changed:
+                return
+            with open(self.path + ".lock", "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    kinds = self._read()
+                    kinds.update((kind, self._kinds[kind]) for kind in self._changed)
+                    atomic_write(self.path, json.dumps(kinds, sort_keys=True).encode("utf-8"))
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+            self._changed.clear()
@@ -0,0 +1,160 @@
+# coding: utf-8
+"""
+Classification of the hosts, datacenters and storage domains by their status, driven by one
+table per kind of object mapping the status values of the API (the ovirtsdk4 enum values) to
+a check state. The tables can be overridden from an INI file, e.g. to treat hosts in
+maintenance as OK during a patch window:
+
+    [host]
+    maintenance = ok
+    reboot = ok
+"""
+from check_result import CheckResult
+from check_result import Perfdata
+from check_result import CRITICAL, OK, STATE_NAMES, UNKNOWN, WARNING
+
+# statuses missing from a table are UNKNOWN
+STATUS_MAPS = {
+    # types.HostStatus
+    "host": {
+        "up": OK,
+        "maintenance": WARNING,
+        "unassigned": WARNING,
+        "reboot": WARNING,
+        "connecting": WARNING,
+        "initializing": WARNING,
+        "error": CRITICAL,
+        "down": CRITICAL,
+        "non_operational": CRITICAL,
+        "non_responsive": CRITICAL,
+    },
+    # types.DataCenterStatus
+    "datacenter": {
+        "up": OK,
+        "maintenance": WARNING,
+        "uninitialized": WARNING,
+        "problematic": CRITICAL,
+        "not_operational": CRITICAL,
+    },
+    # types.ExternalStatus
+    "storage_domain": {
+        "ok": OK,
+        "warning": WARNING,
+        "failure": CRITICAL,
+        "error": CRITICAL,
+    },
+}
+
+_STATES_BY_NAME = {name.lower(): state for state, name in STATE_NAMES.items()}
+
+
+def format_transitions(transitions):
+    """'name: old -> new' for each transition, 'none' when there is none."""
+    if not transitions:
+        return "none"
+    return ", ".join(
+        "{}: {} -> {}".format(name, old if old is not None else "new",
+                              new if new is not None else "removed")
+        for name, old, new in transitions
+    )
+
+
+def load_status_maps(path):
+    """
+    Overrides read from an INI file, one section per kind of object and one ``status = state``
+    option per status, as a dict {kind: {status: state}} which can be sent to the daemon. The
+    kinds and statuses must be the ones of STATUS_MAPS, a typo would be silently ignored.
+    """
+    from configparser import ConfigParser
+    from configparser import Error
+
+    parser = ConfigParser()
+    with open(path) as config_file:
+        try:
+            parser.read_file(config_file)
+        except Error as e:
+            raise ValueError("{}: {}".format(path, e))
+    overrides = dict()
+    for kind in parser.sections():
+        if kind not in STATUS_MAPS:
+            raise ValueError("{}: unknown section [{}], expected one of {}".format(
+                path, kind, ", ".join(sorted(STATUS_MAPS))
+            ))
+        for status, state_name in parser.items(kind):
+            if status.lower() not in STATUS_MAPS[kind]:
+                raise ValueError("{}: [{}] unknown status {}, expected one of {}".format(
+                    path, kind, status, ", ".join(sorted(STATUS_MAPS[kind]))
+                ))
+            state = _STATES_BY_NAME.get(state_name.strip().lower())
+            if state is None:
+                raise ValueError("{}: [{}] {} = {} is not one of ok, warning, critical, "
+                                 "unknown".format(path, kind, status, state_name))
+            overrides.setdefault(kind, dict())[status.lower()] = state
+    return overrides
+
+
+def status_map(kind, overrides=None):
+    """The table of kind with the overrides given to the check, if any, applied."""
+    table = STATUS_MAPS[kind]
+    if overrides and overrides.get(kind):
+        table = dict(table)
+        # overrides sent to the daemon have been through JSON
+        table.update((status, int(state)) for status, state in overrides[kind].items())
+    return table
+
+
+def status_text(status):
+    """The API value of a status, statuses the SDK does not know are kept as text already."""
+    return getattr(status, "value", status)
+
+
+def classify(objects, table, attribute="status"):
+    """
+    (name, status) pairs of the objects by state, in a single pass, and the pairs of all the
+    objects in their order. The statuses are given as text, whether the objects were listed
+    or rebuilt from a state store.
+    """
+    by_state = {OK: [], WARNING: [], CRITICAL: [], UNKNOWN: []}
+    all_items = []
+    for obj in objects:
+        status = status_text(getattr(obj, attribute))
+        item = (obj.name, status)
+        by_state[table.get(status, UNKNOWN)].append(item)
+        all_items.append(item)
+    return by_state, all_items
+
+
+def status_result(label, by_state, all_items, transitions=None):
+    """
+    The CheckResult of the worst state found by classify, label names the objects. The number
+    of objects in each state is given as perfdata, e.g. host_critical=1. With the transitions
+    since the previous run (see StateStore.update) they are reported instead of the status of
+    all the objects.
+    """
+    perfdata = [
+        Perfdata("{}_{}".format(label, STATE_NAMES[state].lower()), len(by_state[state]), min=0)
+        for state in (OK, WARNING, CRITICAL, UNKNOWN)
+    ]
+    if transitions is None:
+        details = "Status of all {} is: {}".format(label, all_items)
+        ok_items = by_state[OK]
+    else:
+        perfdata.append(Perfdata("{}_changes".format(label), len(transitions), min=0))
+        details = "Changes since last run: {}".format(format_transitions(transitions))
+        ok_items = "{} {}(s). {}".format(len(by_state[OK]), label, details)
+
+    if by_state[CRITICAL]:
+        msg = ("Critical: the following {0}(s) definitely have an issue: {1}\n "
+               "{2}".format(label, by_state[CRITICAL], details))
+        return CheckResult(CRITICAL, msg, perfdata)
+    elif by_state[WARNING]:
+        msg = ("Warning: the following {0}(s) may have an issue: {1}\n "
+               "{2}".format(label, by_state[WARNING], details))
+        return CheckResult(WARNING, msg, perfdata)
+    elif by_state[UNKNOWN]:
+        msg = ("Unknown: the following {0}(s) are in an unknown state: {1}\n"
+               "{2}".format(label, by_state[UNKNOWN], details))
+        return CheckResult(UNKNOWN, msg, perfdata)
+    else:
+        msg = ("Ok: all {}(s) are in the OK state: {}".format(label, ok_items))
+        return CheckResult(OK, msg, perfdata)
@@ -5,6 +5,8 @@ import yaml
 import yaycl
 import yaycl_crypt
 
+from check_result import CheckResult
+from check_result import STATE_NAMES
 from rhv_checks import CHECKS
 from rhv_logconf import get_logger
 from wrapanapi.systems.rhevm import RHEVMSystem
@@ -66,13 +68,14 @@ def test_checks(provider_data, credentials, measurement):
 
     system = RHEVMSystem(hostname, username, password, version=4.3)
 
-    # now try run the check
-    with pytest.raises(SystemExit) as pytest_wrapped_e:
-        services = None
-        if measurement == "services_status":
-            services =  {
-                'vdsmd': 'Active: active (running)',
-                'ovirt-ha-agent': 'Active: active (running)'
-            }
-        measure_func(system, logger=logger, services=services)
-    assert pytest_wrapped_e.type == SystemExit
+    # now run the check, it returns its result instead of exiting
+    services = None
+    if measurement == "services_status":
+        services =  {
+            'vdsmd': 'Active: active (running)',
+            'ovirt-ha-agent': 'Active: active (running)'
+        }
+    result = measure_func(system, logger=logger, services=services)
+    assert isinstance(result, CheckResult)
+    assert result.state in STATE_NAMES
+    assert result.message
@@ -0,0 +1,56 @@
+import pytest
+
+from utils import expected_properties
+from utils import is_in_status
+from utils import parse_systemctl_show
+
+SHOW_OUTPUT = """LoadState=loaded
+ActiveState=active
+SubState=running
+UnitFileState=enabled
+FragmentPath=/usr/lib/systemd/system/vdsmd.service
+
+LoadState=loaded
+ActiveState=inactive
+SubState=dead
+UnitFileState=disabled
+FragmentPath=/usr/lib/systemd/system/ovirt-ha-agent.service
+"""
+
+
+@pytest.fixture
+def services():
+    return parse_systemctl_show(SHOW_OUTPUT, ["vdsmd", "ovirt-ha-agent"])
+
+
+def test_parse_systemctl_show(services):
+    assert services["vdsmd"]["SubState"] == "running"
+    assert services["ovirt-ha-agent"]["UnitFileState"] == "disabled"
+
+
+@pytest.mark.parametrize("expected_status, vdsmd, ha_agent", [
+    ("Active: active (running)", True, False),
+    ("Active: active", True, False),
+    ("active (running)", True, False),
+    ("Active: inactive (dead)", False, True),
+    ("Loaded: loaded (", True, True),
+    ("Loaded: loaded (/usr/lib/systemd/system/vdsmd.service; enabled; vendor preset: enabled)",
+     True, False),
+    ("enabled", True, False),
+    ("disabled", False, True),
+    ("active", True, False),
+    ("/usr/lib/systemd/system/ovirt-ha-agent.service", False, True),
+])
+def test_is_in_status(services, expected_status, vdsmd, ha_agent):
+    assert is_in_status(services["vdsmd"], expected_status) is vdsmd
+    assert is_in_status(services["ovirt-ha-agent"], expected_status) is ha_agent
+
+
+@pytest.mark.parametrize("expected_status", [
+    "Active: active (running) since Mon 2020-01-06 10:00:00 UTC; 2 days ago",
+    "running fine",
+    "Loaded: loaded (/usr/lib/systemd/system/vdsmd.service; on)",
+])
+def test_expected_properties_rejects_unmatchable(expected_status):
+    with pytest.raises(ValueError):
+        expected_properties(expected_status)
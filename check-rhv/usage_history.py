@@ -0,0 +1,152 @@
+# coding: utf-8
+"""
+History of the usage of the storage domains, to project when each of them fills up. Every
+sample is appended to a file of fixed-width records per domain; samples older than a couple of
+days are averaged per hour into a second file, and hourly averages past the retention dropped,
+so a domain sampled every 5 minutes for 90 days takes about 60 KiB.
+"""
+import errno
+import fcntl
+import os
+import time
+
+from contextlib import contextmanager
+
+import numpy
+
+from disk_cache import atomic_write
+
+# seconds since the epoch, used and available bytes
+SAMPLE = numpy.dtype([("time", "<f8"), ("used", "<f8"), ("available", "<f8")])
+HOUR = 3600.0
+DAY = 86400.0
+
+
+class UsageHistory(object):
+    """
+    Directory of <storage domain id>.raw files, each sample appended as one record, and
+    <storage domain id>.hourly files of hourly averages. Raw samples older than ``raw_days``
+    are moved to the hourly file, hourly averages older than ``retention_days`` are dropped.
+    """
+
+    def __init__(self, directory, raw_days=2, retention_days=90):
+        self.directory = directory
+        self.raw_days = raw_days
+        self.retention_days = retention_days
+        try:
+            os.makedirs(directory, mode=0o700)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def _path(self, storage_domain_id, tier):
+        return os.path.join(self.directory, "{}.{}".format(storage_domain_id, tier))
+
+    @contextmanager
+    def _lock(self):
+        with open(os.path.join(self.directory, "history.lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _read(path, count=-1):
+        """The records of path, an empty array if there is none."""
+        try:
+            with open(path, "rb") as history_file:
+                data = history_file.read(count * SAMPLE.itemsize if count > 0 else -1)
+        except (IOError, OSError):
+            return numpy.empty(0, dtype=SAMPLE)
+        # a record cut short by a crash while appending is left out
+        return numpy.frombuffer(data[:len(data) - len(data) % SAMPLE.itemsize], dtype=SAMPLE)
+
+    def append(self, samples, now=None):
+        """Record (storage domain id, used bytes, available bytes) samples taken now."""
+        now = time.time() if now is None else now
+        with self._lock():
+            for storage_domain_id, used, available in samples:
+                record = numpy.array([(now, used, available)], dtype=SAMPLE)
+                with open(self._path(storage_domain_id, "raw"), "ab") as raw_file:
+                    raw_file.write(record.tobytes())
+                first = self._read(self._path(storage_domain_id, "raw"), count=1)
+                # downsampled by whole hours, so at most once an hour
+                if first["time"][0] < now - self.raw_days * DAY - HOUR:
+                    self._downsample(storage_domain_id, now)
+
+    def _downsample(self, storage_domain_id, now):
+        raw = self._read(self._path(storage_domain_id, "raw"))
+        cutoff = (now - self.raw_days * DAY) // HOUR * HOUR
+        old, recent = raw[raw["time"] < cutoff], raw[raw["time"] >= cutoff]
+
+        _, hour, counts = numpy.unique(old["time"] // HOUR, return_inverse=True,
+                                       return_counts=True)
+        averages = numpy.empty(len(counts), dtype=SAMPLE)
+        for field in SAMPLE.names:
+            averages[field] = numpy.bincount(hour, weights=old[field]) / counts
+
+        hourly = numpy.concatenate((self._read(self._path(storage_domain_id, "hourly")),
+                                    averages))
+        hourly = hourly[hourly["time"] >= now - self.retention_days * DAY]
+        atomic_write(self._path(storage_domain_id, "hourly"), hourly.tobytes())
+        atomic_write(self._path(storage_domain_id, "raw"), recent.tobytes())
+
+    def series(self, storage_domain_id, since=0.0):
+        """The samples of a storage domain taken since, hourly averages first."""
+        samples = numpy.concatenate((self._read(self._path(storage_domain_id, "hourly")),
+                                     self._read(self._path(storage_domain_id, "raw"))))
+        return samples[samples["time"] >= since]
+
+    def days_to_full(self, storage_domain_ids, window_days=7, min_span_hours=24, now=None):
+        """
+        {storage domain id: days until full} projected from the growth of the used space over
+        the last window_days, fitted by least squares for all the domains at once. Domains
+        sampled over less than min_span_hours are left out, inf when the usage does not grow.
+        """
+        now = time.time() if now is None else now
+        series = [self.series(sd_id, now - window_days * DAY) for sd_id in storage_domain_ids]
+        lengths = numpy.array([len(samples) for samples in series], dtype=numpy.intp)
+        if not lengths.sum():
+            return dict()
+        samples = numpy.concatenate(series)
+        return dict(
+            (storage_domain_ids[index], days)
+            for index, days in fit_days_to_full(samples, lengths, now, min_span_hours / 24.0)
+        )
+
+
+def fit_days_to_full(samples, lengths, now, min_span_days):
+    """
+    (index, days until full) of each series of samples long enough, the samples of series
+    i being the lengths[i] ones after those of series i - 1, in time order. The capacity is
+    the one of the last sample, as a domain may have been extended meanwhile.
+    """
+    count = len(lengths)
+    group = numpy.repeat(numpy.arange(count), lengths)
+    last = numpy.cumsum(lengths) - 1
+    first = last - lengths + 1
+    sizes = numpy.maximum(lengths, 1)
+
+    days = (samples["time"] - now) / DAY
+    used = samples["used"]
+    # centered on each series' means, the sums of squares do not lose the slope to rounding
+    mean_days = numpy.bincount(group, weights=days, minlength=count) / sizes
+    mean_used = numpy.bincount(group, weights=used, minlength=count) / sizes
+    centered_days = days - mean_days[group]
+    variance = numpy.bincount(group, weights=centered_days ** 2, minlength=count)
+    covariance = numpy.bincount(group, weights=centered_days * (used - mean_used[group]),
+                                minlength=count)
+
+    valid = lengths >= 2
+    valid[valid] &= days[last[valid]] - days[first[valid]] >= min_span_days
+    growth = numpy.zeros(count)
+    growth[valid] = covariance[valid] / variance[valid]
+    used_now = mean_used - growth * mean_days
+    capacity = numpy.zeros(count)
+    capacity[valid] = samples["used"][last[valid]] + samples["available"][last[valid]]
+
+    left = numpy.full(count, numpy.inf)
+    growing = valid & (growth > 0)
+    left[growing] = numpy.maximum(capacity[growing] - used_now[growing], 0) / growth[growing]
+    return [(int(index), float(left[index])) for index in numpy.flatnonzero(valid)]
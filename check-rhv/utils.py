@@ -2,17 +2,115 @@
 """
 Helper functions
 """
-from _socket import timeout
+import queue
+import re
+import shlex
+import socket
+import threading
+import time
 
-import paramiko
 
+# unit properties fetched for each service, the ones the expected statuses are compared to
+SERVICE_PROPERTIES = ("LoadState", "ActiveState", "SubState", "UnitFileState", "FragmentPath")
+# values of ActiveState and UnitFileState, to tell what a bare word of a status stands for
+ACTIVE_STATES = ("active", "reloading", "inactive", "failed", "activating", "deactivating")
+UNIT_FILE_STATES = ("enabled", "enabled-runtime", "linked", "linked-runtime", "masked",
+                    "masked-runtime", "static", "disabled", "indirect", "generated", "transient",
+                    "bad")
 
-def is_service_in_status(ssh, name, expected_status):
-    """Helper function for check_services_status to check a specific service's status"""
-    stdin, stdout, stderr = ssh.exec_command("systemctl status {}".format(name))
+def parse_systemctl_show(output, names):
+    """
+    Parse the output of 'systemctl show' for several units: one block of KEY=value lines per
+    unit, separated by empty lines, in the order the units were given.
+    """
+    blocks = output.strip().split("\n\n")
+    services = dict()
+    for name, block in zip(names, blocks):
+        properties = dict()
+        for line in block.splitlines():
+            key, _, value = line.partition("=")
+            properties[key.strip()] = value.strip()
+        services[name] = properties
+    return services
+
+
+def services_properties(ssh, names, timeout=None):
+    """
+    Helper function for check_services_status to get the state of all the services of a host
+    with a single remote command.
+    """
+    command = "systemctl show --property={} {}".format(
+        ",".join(SERVICE_PROPERTIES), " ".join(shlex.quote(name) for name in names)
+    )
+    stdin, stdout, stderr = ssh.exec_command(command, timeout=timeout)
     output = stdout.read()
-    status = output.decode('utf-8').strip()
-    return expected_status in status
+    return parse_systemctl_show(output.decode("utf-8"), names)
+
+
+def _word(text):
+    return re.match(r"^[\w.@-]+$", text) is not None
+
+
+def expected_properties(expected_status):
+    """
+    The unit properties an expected status stands for. It is the 'Loaded:' or 'Active:' line
+    of 'systemctl status', or the start of it, the label of the 'Active:' line being optional,
+    or a unit file state or path:
+        'Active: active (running)'  ActiveState=active, SubState=running
+        'Loaded: loaded (/usr/lib/systemd/system/vdsmd.service; enabled; ...)'
+                                    LoadState=loaded, FragmentPath=..., UnitFileState=enabled
+        'enabled', 'active', '/usr/lib/systemd/system/vdsmd.service'
+    Raises ValueError for a status telling something else, e.g. the time since the service is
+    active, as it could never match.
+    """
+    status = expected_status.strip()
+    if status.split(" ", 1)[0] in ACTIVE_STATES:
+        # the 'Active:' line without its label, e.g. 'active (running)'
+        status = "Active: " + status
+    expected = dict()
+    match = re.match(r"^(Loaded|Active):\s*(\S*)\s*(?:\((.*?)\)?)?\s*$", status)
+    if match is not None:
+        line, state, details = match.groups()
+        if state and not _word(state):
+            raise ValueError("'{}' is not a state in '{}'".format(state, expected_status))
+        if line == "Active":
+            expected["ActiveState"] = state
+            if details is not None and details.strip():
+                if not _word(details.strip()):
+                    raise ValueError("'{}' is not a sub-state in '{}'".format(
+                        details, expected_status))
+                expected["SubState"] = details.strip()
+        else:
+            expected["LoadState"] = state
+            for detail in (details or "").split(";"):
+                detail = detail.strip()
+                if detail.startswith("/"):
+                    expected["FragmentPath"] = detail
+                elif detail in UNIT_FILE_STATES:
+                    expected["UnitFileState"] = detail
+                elif detail and not detail.startswith("vendor preset"):
+                    raise ValueError("'{}' is not a unit file path or state in '{}'".format(
+                        detail, expected_status))
+    elif status.startswith("/"):
+        expected["FragmentPath"] = status
+    elif status in UNIT_FILE_STATES:
+        expected["UnitFileState"] = status
+    else:
+        raise ValueError(
+            "'{}' is not a 'Loaded:' or 'Active:' line of systemctl status, a state or a "
+            "unit file path".format(expected_status)
+        )
+    # an empty state, e.g. in 'Loaded: loaded (', does not tell anything
+    return dict((key, value) for key, value in expected.items() if value)
+
+
+def is_in_status(properties, expected_status):
+    """
+    Whether a service is in the expected status (see expected_properties), comparing each
+    of the properties it stands for with the ones of the service.
+    """
+    return all(properties.get(key) == value
+               for key, value in expected_properties(expected_status).items())
 
 
 def host_ips(host_service):
@@ -27,21 +125,82 @@ def host_ips(host_service):
     return [n.ip.address for n in nics if n.ip is not None and n.ip.address.startswith("10.")]
 
 
-def ssh_client(host_service, username, password):
+def reachable_ip(ip_addresses, port=22, timeout=5):
     """
-    SSH client with a workaround for using IPv4 addresses
+    Race a TCP connection to port on all the addresses at once and return the first one that
+    accepts it, None if none does within timeout.
     """
-    ip_addresses = host_ips(host_service)
+    if not ip_addresses:
+        return None
+    answers = queue.Queue()
+
+    def probe(ip):
+        try:
+            socket.create_connection((ip, port), timeout=timeout).close()
+            answers.put(ip)
+        except (socket.error, socket.timeout):
+            answers.put(None)
+
+    for ip in ip_addresses:
+        prober = threading.Thread(target=probe, args=(ip,))
+        prober.daemon = True
+        prober.start()
+
+    deadline = time.time() + timeout
+    for _ in ip_addresses:
+        try:
+            ip = answers.get(timeout=max(0, deadline - time.time()))
+        except queue.Empty:
+            break
+        if ip is not None:
+            return ip
+    return None
+
+
+def ssh_client(host_service, username, password, timeout=60, address_cache=None, host_id=None,
+               deadline=None):
+    """
+    SSH client with a workaround for using IPv4 addresses, timeout applies to each address.
+    The address the host answered on last time is tried first when an address_cache is given,
+    otherwise the one answering first to a TCP connection among the host's addresses. With a
+    Deadline no address is tried once it is past, whatever timeout is left.
+    """
+    # paramiko and its cryptography stack are only needed by this check
+    import paramiko
+
     ssh = paramiko.SSHClient()
     ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+
+    def limit(seconds):
+        return seconds if deadline is None else deadline.timeout(seconds)
+
+    if address_cache is not None:
+        ip = address_cache.get(host_id)
+        if ip is not None:
+            try:
+                # a TCP connect to a live host takes about one round trip
+                ssh.connect(ip, username=username, password=password,
+                            timeout=limit(min(5, timeout)))
+                return ssh
+            except (socket.timeout, socket.error):
+                address_cache.forget(host_id)
+
+    ip_addresses = host_ips(host_service)
+    fastest_ip = reachable_ip(ip_addresses, timeout=limit(min(5, timeout)))
+    if fastest_ip is not None:
+        ip_addresses = [fastest_ip] + [ip for ip in ip_addresses if ip != fastest_ip]
     for ip in ip_addresses:
+        if deadline is not None and deadline.expired():
+            break
         try:
-            ssh.connect(ip, username=username, password=password, timeout=60)
-            return ssh
-        except timeout:
+            ssh.connect(ip, username=username, password=password, timeout=limit(timeout))
+        except (socket.timeout, socket.error):
             continue
+        if address_cache is not None:
+            address_cache.set(host_id, ip)
+        return ssh
     if ssh.get_transport() is None:
         # An SSH Transport attaches to a stream (usually a socket), negotiates an encrypted session,
         # authenticates, and then creates stream tunnels, called channels, across the session.
         # If connection is not established, returns None.
-        raise timeout("No pingable IP found")
+        raise socket.timeout("No pingable IP found")
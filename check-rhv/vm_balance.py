@@ -0,0 +1,189 @@
+# coding: utf-8
+"""
+Distribution of the VMs over the hosts of each cluster, weighted by the CPU threads and memory
+of the hosts, and the migrations that would even it out. Hosts are handled as numpy arrays, in
+a handful of passes whatever the number of hosts and clusters.
+"""
+import fcntl
+import json
+import threading
+import time
+
+import numpy
+
+from disk_cache import atomic_write
+
+
+def _number(value):
+    # unconvertible text is kept as is by the stream reader
+    return value if isinstance(value, int) else numpy.nan
+
+
+def host_arrays(hosts):
+    """
+    The cluster ids, and for each host the index of its cluster in them, its VMs, CPU threads
+    and memory, NaN for the capacities the API did not send.
+    """
+    cluster_ids, cluster = numpy.unique([host.cluster_id or "" for host in hosts],
+                                        return_inverse=True)
+    vms = numpy.array([host.summary_total or 0 for host in hosts], dtype=float)
+    cpus = numpy.array([
+        _number(host.cpu_sockets) * _number(host.cpu_cores)
+        * (_number(host.cpu_threads) if host.cpu_threads is not None else 1)
+        for host in hosts
+    ], dtype=float)
+    memory = numpy.array([_number(host.memory) for host in hosts], dtype=float)
+    return list(cluster_ids), cluster, vms, cpus, memory
+
+
+def _fill_missing(values, cluster, clusters):
+    """values with the NaNs replaced by the mean of their cluster, 1 if it has no value."""
+    known = ~numpy.isnan(values)
+    totals = numpy.bincount(cluster[known], weights=values[known], minlength=clusters)
+    counts = numpy.bincount(cluster[known], minlength=clusters)
+    means = numpy.where(counts > 0, totals / numpy.maximum(counts, 1), 1.0)
+    return numpy.where(known, values, means[cluster])
+
+
+def expected_vms(cluster, vms, cpus, memory):
+    """
+    VMs each host would run if those of its cluster were spread in proportion to its share
+    of the CPU threads and memory of the cluster, half each. cluster holds the index of the
+    cluster of each host, cpus and memory NaN when unknown.
+    """
+    clusters = cluster.max() + 1 if len(cluster) else 0
+    counts = numpy.bincount(cluster, minlength=clusters)
+    share = numpy.zeros(len(cluster))
+    for capacity in (cpus, memory):
+        capacity = _fill_missing(capacity, cluster, clusters)
+        totals = numpy.bincount(cluster, weights=capacity, minlength=clusters)
+        # the hosts of a cluster reporting no capacity at all get the same share
+        share += numpy.where(totals[cluster] > 0,
+                             capacity / numpy.where(totals > 0, totals, 1)[cluster],
+                             1.0 / counts[cluster])
+    return share / 2 * numpy.bincount(cluster, weights=vms, minlength=clusters)[cluster]
+
+
+def spread(cluster, deviation):
+    """
+    Per cluster, the difference between the most and the least loaded hosts in VMs over
+    their expected share, the plain max - min of the VM counts for identical hosts.
+    """
+    clusters = cluster.max() + 1 if len(cluster) else 0
+    highest = numpy.full(clusters, -numpy.inf)
+    lowest = numpy.full(clusters, numpy.inf)
+    numpy.maximum.at(highest, cluster, deviation)
+    numpy.minimum.at(lowest, cluster, deviation)
+    return highest - lowest
+
+
+def targets(cluster, vms, expected):
+    """
+    Expected VMs of each host rounded to whole VMs keeping the total of each cluster: the
+    VMs left by rounding down go to the hosts with the largest remainders.
+    """
+    clusters = cluster.max() + 1 if len(cluster) else 0
+    floor = numpy.floor(expected)
+    left = (numpy.bincount(cluster, weights=vms, minlength=clusters)
+            - numpy.bincount(cluster, weights=floor, minlength=clusters))
+    # hosts by cluster, largest remainder first, then their rank in their cluster
+    order = numpy.lexsort((floor - expected, cluster))
+    starts = numpy.searchsorted(cluster[order], numpy.arange(clusters))
+    rank = numpy.empty(len(cluster), dtype=numpy.intp)
+    rank[order] = numpy.arange(len(cluster)) - starts[cluster[order]]
+    return (floor + (rank < numpy.round(left)[cluster])).astype(numpy.int64)
+
+
+def migration_plan(cluster, vms, target):
+    """
+    Greedy plan moving VMs from the hosts above their target to the ones below it in the
+    same cluster, the most loaded hosts first: (source, destination, VMs) index arrays.
+    Each cluster adds as many VMs as it removes, so laying the surpluses and the deficits
+    end to end, cluster after cluster, pairs the hosts of a cluster with each other only.
+    """
+    surplus = vms.astype(numpy.int64) - target
+    givers = numpy.flatnonzero(surplus > 0)
+    takers = numpy.flatnonzero(surplus < 0)
+    givers = givers[numpy.lexsort((-surplus[givers], cluster[givers]))]
+    takers = takers[numpy.lexsort((surplus[takers], cluster[takers]))]
+    given = numpy.cumsum(surplus[givers])
+    taken = numpy.cumsum(-surplus[takers])
+
+    bounds = numpy.union1d(given, taken)
+    starts = numpy.concatenate(([0], bounds[:-1]))[:len(bounds)]
+    source = givers[numpy.searchsorted(given, starts, side="right")]
+    destination = takers[numpy.searchsorted(taken, starts, side="right")]
+    return source, destination, bounds - starts
+
+
+def rebalance(cluster, vms, expected, clusters):
+    """
+    (VMs, source, destination) of the migrations of the plan within the clusters of these
+    indexes, the largest first.
+    """
+    source, destination, moved = migration_plan(cluster, vms, targets(cluster, vms, expected))
+    keep = numpy.isin(cluster[source], clusters)
+    source, destination, moved = source[keep], destination[keep], moved[keep]
+    order = numpy.argsort(-moved, kind="stable")
+    return [(int(moved[index]), int(source[index]), int(destination[index]))
+            for index in order]
+
+
+class SpreadHistory(object):
+    """
+    Spread of each cluster at each run, to alert on an imbalance lasting a whole window
+    rather than on a single sample. Kept in a JSON file, or in memory only without a path.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._samples = dict()
+        self._changed = set()
+        self._lock = threading.Lock()
+        if path is not None:
+            self._samples = self._read()
+
+    def _read(self):
+        try:
+            with open(self.path, "r") as history_file:
+                return json.load(history_file)
+        except (IOError, OSError, ValueError):
+            return dict()
+
+    def record(self, spreads, window, now=None):
+        """
+        Add the {cluster id: spread} of now and return the smallest spread of each cluster
+        over the last window seconds, None for the clusters sampled for less than that.
+        """
+        now = time.time() if now is None else now
+        sustained = dict()
+        with self._lock:
+            for cluster_id, value in spreads.items():
+                samples = self._samples.get(cluster_id, []) + [[now, float(value)]]
+                # the last sample older than the window tells the window is covered
+                older = [index for index, (taken, _) in enumerate(samples)
+                         if taken <= now - window]
+                samples = samples[older[-1]:] if older else samples
+                self._samples[cluster_id] = samples
+                self._changed.add(cluster_id)
+                sustained[cluster_id] = (min(sample[1] for sample in samples) if older
+                                         else None)
+        return sustained
+
+    def save(self):
+        """Write the clusters recorded by this process, merged with the file under a lock."""
+        if self.path is None:
+            return
+        with self._lock:
+            if not self._changed:
+                return
+            with open(self.path + ".lock", "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    samples = self._read()
+                    samples.update((cluster_id, self._samples[cluster_id])
+                                   for cluster_id in self._changed)
+                    atomic_write(self.path, json.dumps(samples).encode("utf-8"))
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+            self._changed.clear()